@@ -1,16 +1,26 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Flask, Response, g, has_request_context, render_template, render_template_string, request, redirect, url_for, flash, session, jsonify
+from markupsafe import escape
 import os
-from datetime import datetime, timedelta
-from functools import wraps
+from datetime import date, datetime, timedelta
+from functools import lru_cache, wraps
 import secrets
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import json
+import logging
+import re
+import base64
+import hashlib
+import io
+import click
 import psycopg2
 import psycopg2.extras
-from urllib.parse import urlparse
+import psycopg2.pool
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+                               REGISTRY, generate_latest, multiprocess)
+from urllib.parse import urlparse, parse_qs
 from contextlib import contextmanager
 import threading
+import queue
+import select
 import time
 
 app = Flask(__name__)
@@ -33,117 +43,1115 @@ def parse_database_url(url):
         url = url.replace('postgres://', 'postgresql://', 1)
     
     parsed = urlparse(url)
+    query = parse_qs(parsed.query)
     return {
         'host': parsed.hostname,
         'port': parsed.port or 5432,
         'database': parsed.path.lstrip('/'),
         'user': parsed.username,
         'password': parsed.password,
-        'sslmode': 'require'
+        'sslmode': query.get('sslmode', ['require'])[0]
     }
 
+# Query plan guard: when QUERY_PLAN_GUARD is 'warn' or 'error', every
+# statement is EXPLAINed before it runs and sequential scans over tables
+# larger than QUERY_PLAN_GUARD_ROWS are reported. Statements that scan a
+# whole table on purpose carry an ALLOW_SEQSCAN comment.
+QUERY_PLAN_GUARD = os.environ.get('QUERY_PLAN_GUARD', 'off').lower()
+QUERY_PLAN_GUARD_ROWS = int(os.environ.get('QUERY_PLAN_GUARD_ROWS', 1000))
+ALLOW_SEQSCAN = '/* allow-seqscan */'
+
+plan_violations = []
+
+class SeqScanError(Exception):
+    """Raised by the query plan guard for an unexpected large sequential scan"""
+
+def find_seq_scans(plan):
+    """Yield (relation, plan_rows) for every Seq Scan node in an EXPLAIN JSON plan"""
+    if plan.get('Node Type') == 'Seq Scan':
+        yield plan.get('Relation Name'), plan.get('Plan Rows', 0)
+    for child in plan.get('Plans', []):
+        yield from find_seq_scans(child)
+
+# Per-request query instrumentation: statement count, total DB time and the
+# slowest statements go out as Server-Timing headers and a JSON log line.
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 5))
+LOG_SQL_MAX_CHARS = int(os.environ.get('LOG_SQL_MAX_CHARS', 500))
+
+query_logger = logging.getLogger('todo.queries')
+if not query_logger.handlers:
+    query_logger.addHandler(logging.StreamHandler())
+    query_logger.propagate = False
+query_logger.setLevel(os.environ.get('QUERY_LOG_LEVEL', 'INFO').upper())
+
+_SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+# The second and later rows of a multi-row VALUES list (execute_values batches)
+_SQL_VALUES_ROWS = re.compile(r"(\bVALUES\s*\([^()]*\))(?:\s*,\s*\([^()]*\))+", re.IGNORECASE)
+
+@lru_cache(maxsize=1024)
+def normalize_sql(query):
+    """Collapse whitespace, literals and VALUES rows so repeated statements group together"""
+    query = _SQL_LITERALS.sub('?', ' '.join(query.split()))
+    return _SQL_VALUES_ROWS.sub(r'\1, ...', query)
+
+def log_sql(sql):
+    """Shorten a normalized statement for the query log"""
+    return sql if len(sql) <= LOG_SQL_MAX_CHARS else sql[:LOG_SQL_MAX_CHARS] + '...'
+
+def record_query(query, duration_ms):
+    """Add a statement's timing to the current request's query stats"""
+    if not has_request_context():
+        return
+    stats = g.get('query_stats')
+    if stats is None:
+        stats = g.query_stats = {'count': 0, 'time_ms': 0.0, 'statements': {}}
+    if isinstance(query, bytes):
+        # execute_values sends the whole batch as bytes with its rows inlined
+        query = query.decode('utf-8', 'replace')
+    query = str(query)
+    # Inlined batches are one-off and can be megabytes long, so keep them out of the cache
+    statement = normalize_sql(query) if len(query) <= 4096 else normalize_sql.__wrapped__(query)
+    entry = stats['statements'].setdefault(statement, {'count': 0, 'time_ms': 0.0, 'max_ms': 0.0})
+    entry['count'] += 1
+    entry['time_ms'] += duration_ms
+    entry['max_ms'] = max(entry['max_ms'], duration_ms)
+    stats['count'] += 1
+    stats['time_ms'] += duration_ms
+
+# Prometheus metrics, served from /metrics. With PROMETHEUS_MULTIPROC_DIR set
+# (gunicorn with several workers) every process writes its samples to that
+# directory and the endpoint aggregates them.
+REQUEST_LATENCY = Histogram('todo_request_duration_seconds', 'Request latency by route',
+                            ['endpoint', 'method'],
+                            buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10))
+REQUEST_DB_QUERIES = Histogram('todo_request_db_queries', 'Database statements per request',
+                               ['endpoint'], buckets=(0, 1, 2, 5, 10, 20, 50, 100))
+DB_POOL_CONNECTIONS = Gauge('todo_db_pool_connections', 'Pooled database connections by state',
+                            ['state'], multiprocess_mode='livesum')
+DB_POOL_EVENTS = Counter('todo_db_pool_events', 'Connection pool events', ['event'])
+DB_POOL_WAIT = Counter('todo_db_pool_wait_seconds', 'Time spent waiting for a free connection')
+JOB_DURATION = Histogram('todo_job_duration_seconds', 'Scheduled job run time', ['job', 'status'],
+                         buckets=(.01, .05, .1, .5, 1, 5, 10, 30, 60, 300))
+EMAILS = Counter('todo_emails', 'Outbox emails by delivery result', ['result'])
+CACHE_LOOKUPS = Counter('todo_cache_lookups', 'Process cache lookups', ['key', 'result'])
+
+def metrics_registry():
+    """Registry to export: aggregated across processes in multiprocess mode"""
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+class AppCursor(psycopg2.extras.RealDictCursor):
+    """Dict cursor used for every pooled connection; records timings per request"""
+
+    def execute(self, query, vars=None):
+        if QUERY_PLAN_GUARD != 'off' and self.name is None and isinstance(query, str):
+            self._check_plan(query, vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query, (time.perf_counter() - started) * 1000)
+
+    def _check_plan(self, query, vars):
+        if ALLOW_SEQSCAN in query:
+            return
+        keyword = query.lstrip().split(None, 1)[0].upper() if query.strip() else ''
+        if keyword not in ('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT'):
+            return
+        
+        super().execute('EXPLAIN (FORMAT JSON) ' + query, vars)
+        plan = self.fetchone()['QUERY PLAN'][0]['Plan']
+        for relation, plan_rows in find_seq_scans(plan):
+            super().execute('''
+                SELECT reltuples::bigint AS reltuples FROM pg_class WHERE relname = %s
+            ''', (relation,))
+            row = self.fetchone()
+            table_rows = max(row['reltuples'] if row else 0, plan_rows)
+            if table_rows <= QUERY_PLAN_GUARD_ROWS:
+                continue
+            
+            violation = {
+                'relation': relation,
+                'table_rows': table_rows,
+                'query': ' '.join(query.split()),
+            }
+            plan_violations.append(violation)
+            message = f"Seq Scan on {relation} (~{table_rows} rows): {violation['query']}"
+            if QUERY_PLAN_GUARD == 'error':
+                raise SeqScanError(message)
+            print(f"QUERY PLAN: {message}")
+
+class _PooledConnection:
+    """Bookkeeping for a single connection owned by the pool"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.uses = 0
+
+class ConnectionPool:
+    """Thread-safe Postgres connection pool with health checks and recycling.
+
+    Connections are opened lazily up to ``maxconn``; callers block for up to
+    ``timeout`` seconds when the pool is exhausted. A connection is pinged
+    before reuse if it has been idle longer than ``health_check_after``
+    seconds, and is retired after ``max_uses`` checkouts or ``max_age``
+    seconds. Idle connections beyond ``minconn`` are closed after
+    ``max_idle`` seconds. The pool notices when it has been inherited by a
+    forked worker and starts over without touching the parent's sockets.
+    """
+
+    def __init__(self, db_params, minconn=1, maxconn=10, max_uses=1000, max_age=1800,
+                 max_idle=300, health_check_after=30, timeout=10):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Invalid pool size: min=%s max=%s" % (minconn, maxconn))
+        self.db_params = db_params
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.max_uses = max_uses
+        self.max_age = max_age
+        self.max_idle = max_idle
+        self.health_check_after = health_check_after
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._reset()
+        self.counters = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+            'creations': 0,
+            'recycled': 0,
+            'health_failures': 0,
+        }
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = []
+        self._in_use = {}
+        self._size = 0
+
+    def _count(self, event, amount=1):
+        # Caller holds self._cond
+        self.counters[event] += amount
+        DB_POOL_EVENTS.labels(event).inc(amount)
+
+    def _publish(self):
+        # Caller holds self._cond
+        DB_POOL_CONNECTIONS.labels('idle').set(len(self._idle))
+        DB_POOL_CONNECTIONS.labels('in_use').set(len(self._in_use))
+
+    def _check_pid(self):
+        # Connections inherited across fork() share sockets with the parent;
+        # forget them instead of closing so the parent's sessions survive.
+        if self._pid != os.getpid():
+            self._reset()
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.db_params, cursor_factory=AppCursor)
+        with self._cond:
+            self._count('creations')
+        return _PooledConnection(conn)
+
+    def _discard(self, entry):
+        try:
+            entry.conn.close()
+        except Exception:
+            pass
+
+    def _is_expired(self, entry, now):
+        return (entry.conn.closed
+                or (self.max_uses and entry.uses >= self.max_uses)
+                or (self.max_age and now - entry.created_at >= self.max_age))
+
+    def _is_healthy(self, entry, now):
+        if entry.conn.closed:
+            return False
+        if now - entry.last_used < self.health_check_after:
+            return True
+        try:
+            cur = entry.conn.cursor()
+            cur.execute('SELECT 1')
+            cur.close()
+            entry.conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self):
+        """Check a connection out of the pool, waiting if it is exhausted"""
+        deadline = None
+        while True:
+            entry = None
+            with self._cond:
+                self._check_pid()
+                while not self._idle and self._size >= self.maxconn:
+                    if deadline is None:
+                        deadline = time.monotonic() + self.timeout
+                        self._count('waits')
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._count('timeouts')
+                        raise psycopg2.pool.PoolError(
+                            "Timed out after %ss waiting for a database connection" % self.timeout)
+                    started = time.monotonic()
+                    self._cond.wait(remaining)
+                    waited = time.monotonic() - started
+                    self.counters['wait_time'] += waited
+                    DB_POOL_WAIT.inc(waited)
+                if self._idle:
+                    entry = self._idle.pop()
+                else:
+                    # Reserve the slot before connecting outside the lock
+                    self._size += 1
+
+            now = time.monotonic()
+            if entry is None:
+                try:
+                    entry = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            else:
+                expired = self._is_expired(entry, now)
+                if expired or not self._is_healthy(entry, now):
+                    with self._cond:
+                        self._count('recycled' if expired else 'health_failures')
+                        self._size -= 1
+                        self._cond.notify()
+                    self._discard(entry)
+                    continue
+
+            entry.uses += 1
+            with self._cond:
+                self._count('checkouts')
+                self._in_use[id(entry.conn)] = entry
+                self._publish()
+            return entry.conn
+
+    def putconn(self, conn):
+        """Return a connection to the pool, resetting any open transaction"""
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            entry = self._in_use.pop(id(conn), None)
+        if entry is None:
+            return
+
+        now = time.monotonic()
+        keep = not self._is_expired(entry, now)
+        if keep and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except Exception:
+                keep = False
+
+        expired = []
+        with self._cond:
+            if keep:
+                entry.last_used = now
+                self._idle.append(entry)
+            else:
+                self._size -= 1
+                self._count('recycled')
+                expired.append(entry)
+            # Trim connections that have sat idle past max_idle, oldest first
+            while self._size > self.minconn and self._idle and now - self._idle[0].last_used > self.max_idle:
+                expired.append(self._idle.pop(0))
+                self._size -= 1
+            self._publish()
+            self._cond.notify()
+        for stale in expired:
+            self._discard(stale)
+
+    def warm(self):
+        """Open connections until at least ``minconn`` exist"""
+        while True:
+            with self._cond:
+                self._check_pid()
+                if self._size >= self.minconn:
+                    return
+                self._size += 1
+            try:
+                entry = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            with self._cond:
+                self._idle.append(entry)
+                self._publish()
+                self._cond.notify()
+
+    def closeall(self):
+        """Close every idle connection and forget checked-out ones"""
+        with self._cond:
+            if self._pid != os.getpid():
+                self._reset()
+                return
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._publish()
+        for entry in idle:
+            self._discard(entry)
+
+    def stats(self):
+        """Snapshot of pool size and usage counters"""
+        with self._cond:
+            stats = dict(self.counters)
+            stats.update({
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': len(self._in_use),
+                'minconn': self.minconn,
+                'maxconn': self.maxconn,
+            })
+        return stats
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Get the process-wide connection pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                db_url = get_database_url()
+                if not db_url:
+                    raise ValueError("DATABASE_URL environment variable is required")
+                _pool = ConnectionPool(
+                    parse_database_url(db_url),
+                    minconn=int(os.environ.get('DB_POOL_MIN', 1)),
+                    maxconn=int(os.environ.get('DB_POOL_MAX', 10)),
+                    max_uses=int(os.environ.get('DB_POOL_MAX_USES', 1000)),
+                    max_age=float(os.environ.get('DB_POOL_MAX_AGE', 1800)),
+                    max_idle=float(os.environ.get('DB_POOL_MAX_IDLE', 300)),
+                    health_check_after=float(os.environ.get('DB_POOL_HEALTH_CHECK_AFTER', 30)),
+                    timeout=float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+                )
+    return _pool
+
 @contextmanager
 def get_db_connection():
-    """Context manager for database connections"""
-    conn = None
+    """Context manager for pooled database connections"""
+    pool = get_pool()
+    conn = pool.getconn()
     try:
-        db_url = get_database_url()
-        if not db_url:
-            raise ValueError("DATABASE_URL environment variable is required")
-        
-        db_params = parse_database_url(db_url)
-        conn = psycopg2.connect(**db_params, cursor_factory=psycopg2.extras.RealDictCursor)
         yield conn
-    except Exception as e:
-        if conn:
+    except Exception:
+        try:
             conn.rollback()
-        raise e
+        except Exception:
+            pass
+        raise
     finally:
-        if conn:
-            conn.close()
+        pool.putconn(conn)
+
+class PgListener:
+    """Background thread that LISTENs on Postgres channels and dispatches NOTIFY payloads.
+
+    Callbacks receive the payload string, or None after (re)connecting, when
+    notifications may have been missed and subscribers should resync.
+    """
+
+    def __init__(self):
+        self._handlers = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def subscribe(self, channel, callback):
+        with self._lock:
+            self._handlers.setdefault(channel, []).append(callback)
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='pg-listener', daemon=True)
+                self._thread.start()
+
+    def unsubscribe(self, channel, callback):
+        with self._lock:
+            handlers = self._handlers.get(channel, [])
+            if callback in handlers:
+                handlers.remove(callback)
+
+    def _dispatch(self, channel, payload):
+        with self._lock:
+            handlers = list(self._handlers.get(channel, []))
+        for handler in handlers:
+            try:
+                handler(payload)
+            except Exception as e:
+                print(f"Error handling notification on {channel}: {e}")
+
+    def _run(self):
+        backoff = 1
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**get_pool().db_params)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                cur = conn.cursor()
+                listening = set()
+                backoff = 1
+                while True:
+                    with self._lock:
+                        channels = set(self._handlers) - listening
+                    for channel in channels:
+                        cur.execute(f'LISTEN {channel}')
+                        listening.add(channel)
+                        self._dispatch(channel, None)
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self._dispatch(notify.channel, notify.payload)
+            except Exception as e:
+                print(f"Notification listener error, reconnecting in {backoff}s: {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+            finally:
+                if conn:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+listener = PgListener()
+
+# NOTIFY channel used to drop cached entries in every process
+CACHE_CHANNEL = 'todo_cache'
+
+class TTLCache:
+    """Thread-safe in-process cache with per-key expiry and invalidation.
+
+    Each key carries a version that invalidate() bumps, so a value loaded
+    concurrently with an invalidation is not stored. With CACHE_LISTEN
+    enabled, invalidations made by other processes arrive via NOTIFY on
+    CACHE_CHANNEL; the TTL bounds staleness if a notification is missed.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._listening = False
+
+    def _listen(self):
+        if self._listening or os.environ.get('CACHE_LISTEN', 'true').lower() == 'false':
+            return
+        self._listening = True
+        listener.subscribe(CACHE_CHANNEL, lambda key: self.invalidate(key or None))
+
+    def get(self, key, loader):
+        """Return the cached value for key, calling loader() on a miss"""
+        self._listen()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                CACHE_LOOKUPS.labels(key, 'hit').inc()
+                return entry[1]
+            self.misses += 1
+            CACHE_LOOKUPS.labels(key, 'miss').inc()
+            version = self._versions.get(key, 0)
+        
+        value = loader()
+        with self._lock:
+            if self._versions.get(key, 0) == version:
+                self._entries[key] = (now + self.ttl, value)
+        return value
 
-def init_db():
-    """Initialize the database with all required tables"""
+    def invalidate(self, key=None):
+        """Drop one key, or everything when key is None"""
+        with self._lock:
+            keys = [key] if key else list(set(self._entries) | set(self._versions))
+            for k in keys:
+                self._entries.pop(k, None)
+                self._versions[k] = self._versions.get(k, 0) + 1
+
+cache = TTLCache(ttl=float(os.environ.get('CACHE_TTL', 60)))
+
+def notify_invalidation(cur, key):
+    """Tell every process to drop key once the current transaction commits.
+
+    Callers also invalidate their own cache after committing, in case this
+    process isn't listening.
+    """
+    cur.execute('SELECT pg_notify(%s, %s)', (CACHE_CHANNEL, key))
+
+CATEGORIES_SQL = 'SELECT * FROM categories ORDER BY name'
+
+def get_categories(cur):
+    """All categories ordered by name, served from the cache"""
+    def load():
+        cur.execute(CATEGORIES_SQL)
+        return cur.fetchall()
+    return cache.get('categories', load)
+
+# Schema migrations, applied in order and recorded in schema_version.
+# Released steps must never change; add a new step instead.
+MIGRATIONS = [
+    (1, 'Initial schema', [
+        '''
+        CREATE TABLE IF NOT EXISTS categories (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(255) NOT NULL UNIQUE,
+            color VARCHAR(7) DEFAULT '#667eea',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS todos (
+            id SERIAL PRIMARY KEY,
+            task TEXT NOT NULL,
+            description TEXT,
+            completed BOOLEAN NOT NULL DEFAULT FALSE,
+            priority INTEGER DEFAULT 1,
+            due_date DATE,
+            category_id INTEGER REFERENCES categories(id) ON DELETE SET NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_notified DATE
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS subtasks (
+            id SERIAL PRIMARY KEY,
+            todo_id INTEGER NOT NULL REFERENCES todos(id) ON DELETE CASCADE,
+            title TEXT NOT NULL,
+            completed BOOLEAN NOT NULL DEFAULT FALSE,
+            order_index INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS task_notes (
+            id SERIAL PRIMARY KEY,
+            todo_id INTEGER NOT NULL REFERENCES todos(id) ON DELETE CASCADE,
+            note_type VARCHAR(50) DEFAULT 'note',
+            content TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS settings (
+            key VARCHAR(255) PRIMARY KEY,
+            value TEXT
+        )
+        ''',
+        # Default categories, only for a fresh database
+        '''
+        INSERT INTO categories (name, color)
+        SELECT name, color FROM (VALUES
+            ('Work', '#3b82f6'),
+            ('Personal', '#10b981'),
+            ('Shopping', '#f59e0b'),
+            ('Health', '#ef4444'),
+            ('Learning', '#8b5cf6')
+        ) AS defaults (name, color)
+        WHERE NOT EXISTS (SELECT 1 FROM categories)
+        ''',
+    ]),
+    (2, 'Indexes for hot queries', [
+        # Active tab ordering; the expressions match ACTIVE_PRIORITY_RANK and ACTIVE_DUE_KEY
+        '''
+        CREATE INDEX IF NOT EXISTS todos_active_sort_idx ON todos (
+            (CASE priority WHEN 3 THEN 1 WHEN 2 THEN 2 WHEN 1 THEN 3 ELSE 4 END),
+            (COALESCE(due_date, 'infinity'::date)),
+            created_at DESC,
+            id DESC
+        ) WHERE completed = FALSE
+        ''',
+        # Completed tab ordering
+        '''
+        CREATE INDEX IF NOT EXISTS todos_completed_idx ON todos (updated_at DESC, id DESC)
+        WHERE completed = TRUE
+        ''',
+        # Due-date scans (check_due_tasks, overdue counts)
+        '''
+        CREATE INDEX IF NOT EXISTS todos_open_due_idx ON todos (due_date, last_notified)
+        WHERE completed = FALSE
+        ''',
+        'CREATE INDEX IF NOT EXISTS todos_category_idx ON todos (category_id)',
+        'CREATE INDEX IF NOT EXISTS subtasks_todo_idx ON subtasks (todo_id, order_index, id)',
+        'CREATE INDEX IF NOT EXISTS task_notes_todo_idx ON task_notes (todo_id, created_at DESC)',
+    ]),
+    (3, 'Index completed todos by due date for the calendar', [
+        '''
+        CREATE INDEX IF NOT EXISTS todos_completed_due_idx ON todos (due_date)
+        WHERE completed = TRUE
+        ''',
+    ]),
+    (4, 'Email outbox', [
+        '''
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id SERIAL PRIMARY KEY,
+            to_email TEXT,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS email_outbox_pending_idx ON email_outbox (next_attempt_at, id)
+        WHERE status = 'pending'
+        ''',
+    ]),
+    (5, 'Job run history', [
+        '''
+        CREATE TABLE IF NOT EXISTS job_runs (
+            id SERIAL PRIMARY KEY,
+            job_name VARCHAR(100) NOT NULL,
+            started_at TIMESTAMP NOT NULL,
+            duration_ms DOUBLE PRECISION NOT NULL,
+            status VARCHAR(20) NOT NULL,
+            error TEXT
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS job_runs_name_idx ON job_runs (job_name, started_at DESC)',
+    ]),
+    # Expression indexes rather than stored columns keep search vectors out of
+    # the SELECT * results; the expressions must match the *_SEARCH_DOC constants
+    (6, 'Full-text search indexes', [
+        '''
+        CREATE INDEX IF NOT EXISTS todos_search_idx ON todos USING GIN ((
+            setweight(to_tsvector('english', coalesce(task, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(description, '')), 'B')
+        ))
+        ''',
+        "CREATE INDEX IF NOT EXISTS subtasks_search_idx ON subtasks USING GIN ((to_tsvector('english', title)))",
+        "CREATE INDEX IF NOT EXISTS task_notes_search_idx ON task_notes USING GIN ((to_tsvector('english', content)))",
+    ]),
+    # Per-todo counter for subtask order_index, bumped under the todo's row lock
+    (7, 'Subtask order counter', [
+        'ALTER TABLE todos ADD COLUMN IF NOT EXISTS subtask_seq INTEGER NOT NULL DEFAULT 0',
+        '''
+        UPDATE todos t SET subtask_seq = s.max_order
+        FROM (
+            SELECT todo_id, MAX(order_index) AS max_order FROM subtasks GROUP BY todo_id
+        ) s
+        WHERE t.id = s.todo_id AND s.max_order > 0
+        ''',
+    ]),
+    # Per-table change counters behind the ETags; bumped in the writing
+    # transaction so a new version is never visible before its data
+    (8, 'Data version counters', [
+        '''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name VARCHAR(63) PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0
+        )
+        ''',
+        '''
+        INSERT INTO data_versions (name)
+        VALUES ('todos'), ('subtasks'), ('task_notes'), ('categories')
+        ON CONFLICT (name) DO NOTHING
+        ''',
+        '''
+        CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+        BEGIN
+            UPDATE data_versions SET version = version + 1 WHERE name = TG_TABLE_NAME;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        ''',
+    ] + [
+        f'''
+        DROP TRIGGER IF EXISTS {table}_data_version ON {table};
+        CREATE TRIGGER {table}_data_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version()
+        '''
+        for table in ('todos', 'subtasks', 'task_notes', 'categories')
+    ]),
+    # Todo counts per (category, priority, completed, due date), kept current
+    # by statement-level triggers over the transition tables. Completed todos
+    # share one due_key since only open ones can be overdue; NULL category
+    # and priority are stored as 0 and a NULL due date as 'infinity'.
+    # The key expressions must match TODO_STATS_KEY.
+    (9, 'Todo stats summary', [
+        'LOCK TABLE todos IN SHARE MODE',
+        '''
+        CREATE TABLE IF NOT EXISTS todo_stats_summary (
+            category_key INTEGER NOT NULL,
+            priority_key INTEGER NOT NULL,
+            completed BOOLEAN NOT NULL,
+            due_key DATE NOT NULL,
+            todo_count BIGINT NOT NULL,
+            PRIMARY KEY (category_key, priority_key, completed, due_key)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS todo_stats_summary_empty_idx ON todo_stats_summary (category_key) WHERE todo_count <= 0',
+        '''
+        CREATE OR REPLACE FUNCTION apply_todo_stats() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                UPDATE todo_stats_summary s SET todo_count = s.todo_count - d.todo_count
+                FROM (
+                    SELECT COALESCE(category_id, 0) AS category_key,
+                           COALESCE(priority, 0) AS priority_key,
+                           completed,
+                           CASE WHEN completed THEN 'infinity'::date ELSE COALESCE(due_date, 'infinity') END AS due_key,
+                           COUNT(*) AS todo_count
+                    FROM old_rows GROUP BY 1, 2, 3, 4
+                ) d
+                WHERE s.category_key = d.category_key AND s.priority_key = d.priority_key
+                AND s.completed = d.completed AND s.due_key = d.due_key;
+                DELETE FROM todo_stats_summary WHERE todo_count <= 0;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO todo_stats_summary AS s (category_key, priority_key, completed, due_key, todo_count)
+                SELECT COALESCE(category_id, 0),
+                       COALESCE(priority, 0),
+                       completed,
+                       CASE WHEN completed THEN 'infinity'::date ELSE COALESCE(due_date, 'infinity') END,
+                       COUNT(*)
+                FROM new_rows GROUP BY 1, 2, 3, 4 ORDER BY 1, 2, 3, 4
+                ON CONFLICT (category_key, priority_key, completed, due_key)
+                DO UPDATE SET todo_count = s.todo_count + EXCLUDED.todo_count;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        ''',
+        '''
+        DROP TRIGGER IF EXISTS todos_stats_insert ON todos;
+        CREATE TRIGGER todos_stats_insert AFTER INSERT ON todos
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION apply_todo_stats()
+        ''',
+        '''
+        DROP TRIGGER IF EXISTS todos_stats_update ON todos;
+        CREATE TRIGGER todos_stats_update AFTER UPDATE ON todos
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION apply_todo_stats()
+        ''',
+        '''
+        DROP TRIGGER IF EXISTS todos_stats_delete ON todos;
+        CREATE TRIGGER todos_stats_delete AFTER DELETE ON todos
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION apply_todo_stats()
+        ''',
+        'DELETE FROM todo_stats_summary',
+        '''
+        INSERT INTO todo_stats_summary (category_key, priority_key, completed, due_key, todo_count)
+        SELECT COALESCE(category_id, 0),
+               COALESCE(priority, 0),
+               completed,
+               CASE WHEN completed THEN 'infinity'::date ELSE COALESCE(due_date, 'infinity') END,
+               COUNT(*)
+        FROM todos GROUP BY 1, 2, 3, 4
+        ''',
+    ]),
+    # Keyset paging of a todo's notes, and finding activity old enough to compact
+    (10, 'Note paging and activity compaction indexes', [
+        'CREATE INDEX IF NOT EXISTS task_notes_todo_page_idx ON task_notes (todo_id, created_at DESC, id DESC)',
+        'DROP INDEX IF EXISTS task_notes_todo_idx',
+        "CREATE INDEX IF NOT EXISTS task_notes_activity_idx ON task_notes (created_at) WHERE note_type = 'activity'",
+    ]),
+    # Cold storage for long-completed todos. Columns mirror the hot tables in
+    # the same order (see TODO_COLUMNS); ids are kept so links stay valid.
+    (11, 'Archive tables', [
+        '''
+        CREATE TABLE IF NOT EXISTS todos_archive (
+            id INTEGER PRIMARY KEY,
+            task TEXT NOT NULL,
+            description TEXT,
+            completed BOOLEAN NOT NULL DEFAULT TRUE,
+            priority INTEGER DEFAULT 1,
+            due_date DATE,
+            category_id INTEGER REFERENCES categories(id) ON DELETE SET NULL,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP,
+            last_notified DATE,
+            subtask_seq INTEGER NOT NULL DEFAULT 0,
+            archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS subtasks_archive (
+            id INTEGER PRIMARY KEY,
+            todo_id INTEGER NOT NULL REFERENCES todos_archive(id) ON DELETE CASCADE,
+            title TEXT NOT NULL,
+            completed BOOLEAN NOT NULL DEFAULT FALSE,
+            order_index INTEGER DEFAULT 0,
+            created_at TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS task_notes_archive (
+            id INTEGER PRIMARY KEY,
+            todo_id INTEGER NOT NULL REFERENCES todos_archive(id) ON DELETE CASCADE,
+            note_type VARCHAR(50) DEFAULT 'note',
+            content TEXT NOT NULL,
+            created_at TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS todos_archive_completed_idx ON todos_archive (updated_at DESC, id DESC)',
+        'CREATE INDEX IF NOT EXISTS todos_archive_due_idx ON todos_archive (due_date)',
+        'CREATE INDEX IF NOT EXISTS todos_archive_category_idx ON todos_archive (category_id)',
+        'CREATE INDEX IF NOT EXISTS subtasks_archive_todo_idx ON subtasks_archive (todo_id, order_index, id)',
+        'CREATE INDEX IF NOT EXISTS task_notes_archive_todo_idx ON task_notes_archive (todo_id, created_at DESC, id DESC)',
+        '''
+        CREATE INDEX IF NOT EXISTS todos_archive_search_idx ON todos_archive USING GIN ((
+            setweight(to_tsvector('english', coalesce(task, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(description, '')), 'B')
+        ))
+        ''',
+        "CREATE INDEX IF NOT EXISTS subtasks_archive_search_idx ON subtasks_archive USING GIN ((to_tsvector('english', title)))",
+        "CREATE INDEX IF NOT EXISTS task_notes_archive_search_idx ON task_notes_archive USING GIN ((to_tsvector('english', content)))",
+        '''
+        INSERT INTO data_versions (name)
+        VALUES ('todos_archive'), ('subtasks_archive'), ('task_notes_archive')
+        ON CONFLICT (name) DO NOTHING
+        ''',
+    ] + [
+        f'''
+        DROP TRIGGER IF EXISTS {table}_data_version ON {table};
+        CREATE TRIGGER {table}_data_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version()
+        '''
+        for table in ('todos_archive', 'subtasks_archive', 'task_notes_archive')
+    ] + [
+        # Archived todos still count towards the stats; a move is -1 hot, +1 archive
+        '''
+        DROP TRIGGER IF EXISTS todos_archive_stats_insert ON todos_archive;
+        CREATE TRIGGER todos_archive_stats_insert AFTER INSERT ON todos_archive
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION apply_todo_stats()
+        ''',
+        '''
+        DROP TRIGGER IF EXISTS todos_archive_stats_update ON todos_archive;
+        CREATE TRIGGER todos_archive_stats_update AFTER UPDATE ON todos_archive
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION apply_todo_stats()
+        ''',
+        '''
+        DROP TRIGGER IF EXISTS todos_archive_stats_delete ON todos_archive;
+        CREATE TRIGGER todos_archive_stats_delete AFTER DELETE ON todos_archive
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION apply_todo_stats()
+        ''',
+    ]),
+    # Change feed for /api/events: one NOTIFY per statement on todo_events
+    # listing the affected todo ids (TG_ARGV[0] names the id column), or a
+    # resync hint when a statement touches too many todos to list
+    (12, 'Todo change notifications', [
+        '''
+        CREATE OR REPLACE FUNCTION notify_todo_event() RETURNS trigger AS $$
+        DECLARE
+            ids INTEGER[];
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                EXECUTE format('SELECT array_agg(DISTINCT %I) FROM old_rows', TG_ARGV[0]) INTO ids;
+            ELSE
+                EXECUTE format('SELECT array_agg(DISTINCT %I) FROM new_rows', TG_ARGV[0]) INTO ids;
+            END IF;
+            IF ids IS NULL THEN
+                RETURN NULL;
+            END IF;
+            IF array_length(ids, 1) > 200 THEN
+                PERFORM pg_notify('todo_events', json_build_object(
+                    'table', TG_TABLE_NAME, 'op', TG_OP, 'resync', TRUE)::text);
+            ELSE
+                PERFORM pg_notify('todo_events', json_build_object(
+                    'table', TG_TABLE_NAME, 'op', TG_OP, 'todo_ids', ids)::text);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        ''',
+    ] + [
+        f'''
+        DROP TRIGGER IF EXISTS {table}_events_{op.lower()} ON {table};
+        CREATE TRIGGER {table}_events_{op.lower()} AFTER {op} ON {table}
+            REFERENCING {transition}
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_todo_event('{column}')
+        '''
+        for table, column in (('todos', 'id'), ('subtasks', 'todo_id'), ('todos_archive', 'id'))
+        for op, transition in (('INSERT', 'NEW TABLE AS new_rows'),
+                               ('UPDATE', 'NEW TABLE AS new_rows'),
+                               ('DELETE', 'OLD TABLE AS old_rows'))
+    ]),
+    # The stats summary drops its due-date key so it stays one row per
+    # (category, priority, completed); overdue counts come from an index-only
+    # scan of open todos by due date instead. Triggers upsert net deltas in
+    # key order, so concurrent writers lock summary rows in the same order.
+    # Rows that reach zero are kept rather than deleted for the same reason.
+    # The key expressions must match TODO_STATS_KEY.
+    (13, 'Stats summary keyed by category, priority and completion', [
+        'LOCK TABLE todos, todos_archive IN SHARE MODE',
+        'DROP TABLE IF EXISTS todo_stats_summary',
+        '''
+        CREATE TABLE todo_stats_summary (
+            category_key INTEGER NOT NULL,
+            priority_key INTEGER NOT NULL,
+            completed BOOLEAN NOT NULL,
+            todo_count BIGINT NOT NULL,
+            PRIMARY KEY (category_key, priority_key, completed)
+        )
+        ''',
+        '''
+        CREATE OR REPLACE FUNCTION apply_todo_stats() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO todo_stats_summary AS s (category_key, priority_key, completed, todo_count)
+                SELECT COALESCE(category_id, 0), COALESCE(priority, 0), completed, COUNT(*)
+                FROM new_rows GROUP BY 1, 2, 3 ORDER BY 1, 2, 3
+                ON CONFLICT (category_key, priority_key, completed)
+                DO UPDATE SET todo_count = s.todo_count + EXCLUDED.todo_count;
+            ELSIF TG_OP = 'DELETE' THEN
+                INSERT INTO todo_stats_summary AS s (category_key, priority_key, completed, todo_count)
+                SELECT COALESCE(category_id, 0), COALESCE(priority, 0), completed, -COUNT(*)
+                FROM old_rows GROUP BY 1, 2, 3 ORDER BY 1, 2, 3
+                ON CONFLICT (category_key, priority_key, completed)
+                DO UPDATE SET todo_count = s.todo_count + EXCLUDED.todo_count;
+            ELSE
+                INSERT INTO todo_stats_summary AS s (category_key, priority_key, completed, todo_count)
+                SELECT category_key, priority_key, completed, SUM(delta)
+                FROM (
+                    SELECT COALESCE(category_id, 0) AS category_key, COALESCE(priority, 0) AS priority_key,
+                           completed, 1 AS delta
+                    FROM new_rows
+                    UNION ALL
+                    SELECT COALESCE(category_id, 0), COALESCE(priority, 0), completed, -1
+                    FROM old_rows
+                ) d
+                GROUP BY 1, 2, 3 HAVING SUM(delta) <> 0 ORDER BY 1, 2, 3
+                ON CONFLICT (category_key, priority_key, completed)
+                DO UPDATE SET todo_count = s.todo_count + EXCLUDED.todo_count;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        ''',
+        '''
+        INSERT INTO todo_stats_summary (category_key, priority_key, completed, todo_count)
+        SELECT COALESCE(category_id, 0), COALESCE(priority, 0), completed, COUNT(*)
+        FROM (
+            SELECT category_id, priority, completed FROM todos
+            UNION ALL
+            SELECT category_id, priority, completed FROM todos_archive
+        ) t
+        GROUP BY 1, 2, 3
+        ''',
+        # Serves check_due_tasks as before, and the overdue counts index-only
+        '''
+        CREATE INDEX IF NOT EXISTS todos_open_due_stats_idx ON todos (due_date, last_notified)
+        INCLUDE (category_id, priority) WHERE completed = FALSE
+        ''',
+        'DROP INDEX IF EXISTS todos_open_due_idx',
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# Advisory lock held while migrating so concurrent instances don't race
+MIGRATION_LOCK_ID = 727001
+
+def get_schema_version(cur):
+    """Return the applied schema version, 0 for an empty database"""
+    cur.execute("SELECT to_regclass('schema_version') IS NOT NULL AS present")
+    if not cur.fetchone()['present']:
+        return 0
+    cur.execute('SELECT COALESCE(MAX(version), 0) AS version FROM schema_version')
+    return cur.fetchone()['version']
+
+def migrate():
+    """Apply pending migrations and return the versions that were applied"""
+    applied = []
     with get_db_connection() as conn:
         cur = conn.cursor()
-        
-        # Categories table
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS categories (
-                id SERIAL PRIMARY KEY,
-                name VARCHAR(255) NOT NULL UNIQUE,
-                color VARCHAR(7) DEFAULT '#667eea',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Todos table (enhanced)
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS todos (
-                id SERIAL PRIMARY KEY,
-                task TEXT NOT NULL,
-                description TEXT,
-                completed BOOLEAN NOT NULL DEFAULT FALSE,
-                priority INTEGER DEFAULT 1,
-                due_date DATE,
-                category_id INTEGER REFERENCES categories(id) ON DELETE SET NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_notified DATE
-            )
-        ''')
-        
-        # Subtasks table
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS subtasks (
-                id SERIAL PRIMARY KEY,
-                todo_id INTEGER NOT NULL REFERENCES todos(id) ON DELETE CASCADE,
-                title TEXT NOT NULL,
-                completed BOOLEAN NOT NULL DEFAULT FALSE,
-                order_index INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Task notes/activity log table
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS task_notes (
-                id SERIAL PRIMARY KEY,
-                todo_id INTEGER NOT NULL REFERENCES todos(id) ON DELETE CASCADE,
-                note_type VARCHAR(50) DEFAULT 'note',
-                content TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Settings table for email configuration
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS settings (
-                key VARCHAR(255) PRIMARY KEY,
-                value TEXT
-            )
-        ''')
-        
-        # Create default categories only if categories table is empty
-        cur.execute('SELECT COUNT(*) FROM categories')
-        if cur.fetchone()['count'] == 0:
-            categories = [
-                ('Work', '#3b82f6'),
-                ('Personal', '#10b981'),
-                ('Shopping', '#f59e0b'),
-                ('Health', '#ef4444'),
-                ('Learning', '#8b5cf6')
-            ]
+        cur.execute('SELECT pg_advisory_lock(%s)', (MIGRATION_LOCK_ID,))
+        try:
+            cur.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            conn.commit()
             
-            for name, color in categories:
-                cur.execute('INSERT INTO categories (name, color) VALUES (%s, %s)', (name, color))
-        
-        conn.commit()
+            current = get_schema_version(cur)
+            for version, description, statements in MIGRATIONS:
+                if version <= current:
+                    continue
+                # Each step commits on its own so a failure keeps earlier progress
+                for statement in statements:
+                    cur.execute(statement)
+                cur.execute('INSERT INTO schema_version (version, description) VALUES (%s, %s)',
+                            (version, description))
+                conn.commit()
+                applied.append(version)
+        finally:
+            conn.rollback()
+            cur.execute('SELECT pg_advisory_unlock(%s)', (MIGRATION_LOCK_ID,))
+            conn.commit()
+    return applied
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+# 'request' verifies the schema version on the first database request in
+# each process and refuses to serve a stale schema; 'off' skips the check.
+# Migrations are applied by ``flask migrate``, never by request handlers,
+# unless AUTO_MIGRATE=true opts back in (e.g. for local development).
+SCHEMA_CHECK = os.environ.get('SCHEMA_CHECK', 'request').lower()
+
+def ensure_schema():
+    """Verify the schema version once per process, raising if it is stale.
+
+    With AUTO_MIGRATE=true pending migrations are applied instead.
+    """
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        with get_db_connection() as conn:
+            current = get_schema_version(conn.cursor())
+        if current < SCHEMA_VERSION:
+            if os.environ.get('AUTO_MIGRATE', 'false').lower() != 'true':
+                print(f"Schema check failed: database at version {current}, expected {SCHEMA_VERSION}")
+                raise RuntimeError(
+                    f"Database schema is at version {current}, expected {SCHEMA_VERSION}. Run 'flask migrate'.")
+            migrate()
+        _schema_ready = True
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Apply pending database migrations."""
+    applied = migrate()
+    if applied:
+        print(f"Applied migrations: {', '.join(str(v) for v in applied)}")
+    else:
+        print(f"Schema already at version {SCHEMA_VERSION}")
 
 # Email configuration functions
 def get_email_config():
-    """Get email configuration from database"""
-    try:
+    """Get email configuration from database (cached)"""
+    def load():
         with get_db_connection() as conn:
             cur = conn.cursor()
             cur.execute(
@@ -152,8 +1160,8 @@ def get_email_config():
             settings = cur.fetchall()
             
             config = {
-                'smtp_server': 'smtp.gmail.com',
-                'smtp_port': 587,
+                'smtp_server': os.environ.get('SMTP_SERVER', 'smtp.gmail.com'),
+                'smtp_port': int(os.environ.get('SMTP_PORT', 587)),
                 'email': '',
                 'password': '',
                 'enabled': False
@@ -168,11 +1176,14 @@ def get_email_config():
                     config['enabled'] = setting['value'] == 'true'
             
             return config
+    
+    try:
+        return dict(cache.get('email_config', load))
     except Exception as e:
         print(f"Error getting email config: {e}")
         return {
-            'smtp_server': 'smtp.gmail.com',
-            'smtp_port': 587,
+            'smtp_server': os.environ.get('SMTP_SERVER', 'smtp.gmail.com'),
+            'smtp_port': int(os.environ.get('SMTP_PORT', 587)),
             'email': '',
             'password': '',
             'enabled': False
@@ -192,133 +1203,748 @@ def save_email_config(email, password, enabled):
         cur.execute("INSERT INTO settings (key, value) VALUES ('email', %s)", (email,))
         cur.execute("INSERT INTO settings (key, value) VALUES ('email_password', %s)", (password,))
         cur.execute("INSERT INTO settings (key, value) VALUES ('email_enabled', %s)", ('true' if enabled else 'false',))
+        notify_invalidation(cur, 'email_config')
         
         conn.commit()
+    cache.invalidate('email_config')
 
-def send_email_notification(subject, body, to_email=None):
-    """Send email notification with enhanced debugging"""
-    email_config = get_email_config()
-    
-    print(f"DEBUG: Email config check:")
-    print(f"  - Email: {email_config['email']}")
-    print(f"  - Password set: {'Yes' if email_config['password'] else 'No'}")
-    print(f"  - Enabled: {email_config['enabled']}")
-    
-    if not email_config['enabled']:
+# Outgoing mail is queued in email_outbox and delivered by EmailWorker, either
+# in a background thread of the web process (EMAIL_WORKER=thread) or by a
+# separate `flask send-emails --loop` process (EMAIL_WORKER=off).
+EMAIL_CHANNEL = 'email_outbox'
+EMAIL_BATCH_SIZE = int(os.environ.get('EMAIL_BATCH_SIZE', 50))
+EMAIL_MAX_ATTEMPTS = int(os.environ.get('EMAIL_MAX_ATTEMPTS', 5))
+EMAIL_RETRY_DELAY = float(os.environ.get('EMAIL_RETRY_DELAY', 30))
+EMAIL_POLL_INTERVAL = float(os.environ.get('EMAIL_POLL_INTERVAL', 60))
+SMTP_IDLE_TIMEOUT = float(os.environ.get('SMTP_IDLE_TIMEOUT', 60))
+
+def email_ready(config):
+    """Whether the configuration allows sending, logging the reason if not"""
+    if not config['enabled']:
         print("EMAIL: Notifications disabled in settings")
         return False
-        
-    if not email_config['email']:
+    if not config['email']:
         print("EMAIL: No email address configured")
         return False
-        
-    if not email_config['password']:
+    if not config['password']:
         print("EMAIL: No email password configured")
         return False
+    return True
+
+def enqueue_email(cur, subject, body, to_email=None):
+    """Add an email to the outbox; workers are woken when the transaction commits"""
+    cur.execute('''
+        INSERT INTO email_outbox (to_email, subject, body)
+        VALUES (%s, %s, %s)
+        RETURNING id
+    ''', (to_email, subject, body))
+    outbox_id = cur.fetchone()['id']
+    cur.execute('SELECT pg_notify(%s, %s)', (EMAIL_CHANNEL, str(outbox_id)))
+    return outbox_id
+
+def send_email_notification(subject, body, to_email=None, cur=None):
+    """Queue an email notification, returning False if email is not configured.
+
+    Pass ``cur`` to enqueue inside the caller's transaction.
+    """
+    if not email_ready(get_email_config()):
+        return False
     
-    try:
-        print(f"EMAIL: Attempting to send email...")
+    if cur is not None:
+        enqueue_email(cur, subject, body, to_email)
+    else:
+        with get_db_connection() as conn:
+            enqueue_email(conn.cursor(), subject, body, to_email)
+            conn.commit()
+    
+    if os.environ.get('EMAIL_WORKER', 'thread').lower() == 'thread':
+        email_worker.start()
+    print(f"EMAIL: Queued: {subject}")
+    return True
+
+class EmailWorker:
+    """Delivers queued emails in batches over one reused SMTP session.
+
+    Rows are claimed with FOR UPDATE SKIP LOCKED, so several workers can
+    drain the outbox at once. Failed sends are retried with exponential
+    backoff until EMAIL_MAX_ATTEMPTS is reached.
+    """
+
+    def __init__(self, batch_size=EMAIL_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.sent = 0
+        self.failed = 0
+        self._smtp = None
+        self._smtp_key = None
+        self._smtp_last_used = 0
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def wake(self):
+        """Check the outbox now instead of at the next poll"""
+        self._wake.set()
+
+    def start(self):
+        """Start the background sender thread in this process if needed"""
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                self.wake()
+                return
+            self._pid = os.getpid()
+            self._smtp = None
+            self._thread = threading.Thread(target=self.run, name='email-worker', daemon=True)
+            self._thread.start()
+        listener.subscribe(EMAIL_CHANNEL, lambda payload: self.wake())
+
+    def run(self, once=False):
+        """Drain the outbox, then wait for new mail or the next retry"""
+        while True:
+            try:
+                while self.drain():
+                    pass
+            except Exception as e:
+                print(f"EMAIL: Worker error - {e}")
+            if once:
+                self.close()
+                return
+            if self._wake.wait(min(EMAIL_POLL_INTERVAL, SMTP_IDLE_TIMEOUT)):
+                self._wake.clear()
+            elif self._smtp is not None and time.monotonic() - self._smtp_last_used > SMTP_IDLE_TIMEOUT:
+                self.close()
+
+    def _session(self, config):
+        key = (config['smtp_server'], config['smtp_port'], config['email'], config['password'])
+        if self._smtp is not None and self._smtp_key != key:
+            self.close()
+        if self._smtp is None:
+            import smtplib
+            server = smtplib.SMTP(config['smtp_server'], config['smtp_port'], timeout=30)
+            if os.environ.get('SMTP_STARTTLS', 'true').lower() != 'false':
+                server.starttls()
+            if server.has_extn('auth'):
+                server.login(config['email'], config['password'])
+            self._smtp = server
+            self._smtp_key = key
+        self._smtp_last_used = time.monotonic()
+        return self._smtp
+
+    def _send(self, config, message):
+        # The email stack is only needed by the worker; keep it off the cold-start path
+        import smtplib
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.text import MIMEText
         
-        # Create message
         msg = MIMEMultipart()
-        msg['From'] = email_config['email']
-        msg['To'] = to_email or email_config['email']
-        msg['Subject'] = subject
+        msg['From'] = config['email']
+        msg['To'] = message['to_email'] or config['email']
+        msg['Subject'] = message['subject']
+        msg.attach(MIMEText(message['body'], 'html'))
         
-        # Add body to email
-        msg.attach(MIMEText(body, 'html'))
+        for attempt in range(2):
+            try:
+                self._session(config).sendmail(config['email'], msg['To'], msg.as_string())
+                return
+            except smtplib.SMTPServerDisconnected:
+                # The reused session went stale; reconnect once
+                self.close()
+                if attempt:
+                    raise
+
+    def close(self):
+        """Close the SMTP session, if any"""
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+    def drain(self):
+        """Send one batch of due emails and return how many were processed"""
+        config = get_email_config()
+        if not email_ready(config):
+            return 0
         
-        # Gmail SMTP configuration
-        server = smtplib.SMTP(email_config['smtp_server'], email_config['smtp_port'])
-        server.starttls()
-        server.login(email_config['email'], email_config['password'])
-        server.sendmail(email_config['email'], to_email or email_config['email'], msg.as_string())
-        server.quit()
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('''
+                SELECT * FROM email_outbox
+                WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+                ORDER BY next_attempt_at, id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ''', (self.batch_size,))
+            batch = cur.fetchall()
+            
+            sent_ids = []
+            for message in batch:
+                try:
+                    self._send(config, message)
+                    sent_ids.append(message['id'])
+                except Exception as e:
+                    self.close()
+                    self.failed += 1
+                    EMAILS.labels('failed').inc()
+                    print(f"EMAIL: Error sending '{message['subject']}' - {e}")
+                    cur.execute('''
+                        UPDATE email_outbox
+                        SET attempts = attempts + 1,
+                            status = CASE WHEN attempts + 1 >= %s THEN 'failed' ELSE 'pending' END,
+                            next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => %s * power(2, attempts)),
+                            last_error = %s
+                        WHERE id = %s
+                    ''', (EMAIL_MAX_ATTEMPTS, EMAIL_RETRY_DELAY, str(e), message['id']))
+            
+            if sent_ids:
+                cur.execute('''
+                    UPDATE email_outbox
+                    SET status = 'sent', attempts = attempts + 1, sent_at = CURRENT_TIMESTAMP, last_error = NULL
+                    WHERE id = ANY(%s)
+                ''', (sent_ids,))
+                self.sent += len(sent_ids)
+                EMAILS.labels('sent').inc(len(sent_ids))
+                print(f"EMAIL: Sent {len(sent_ids)} message(s)")
+            conn.commit()
+            return len(batch)
+
+email_worker = EmailWorker()
+
+# Periodic jobs, run in registration order by run_jobs(): name -> (function, interval seconds)
+JOBS = {}
+
+def scheduled_job(name, interval):
+    """Register a function as a periodic job"""
+    def decorator(f):
+        JOBS[name] = (f, interval)
+        return f
+    return decorator
+
+PRIORITY_COLORS = {1: '#f59e0b', 2: '#ef4444', 3: '#dc2626'}
+PRIORITY_LABELS = {1: 'Low', 2: 'Medium', 3: 'High'}
+
+_digest_template = None
+
+def render_due_digest(tasks, now=None):
+    """Render the due-today digest, returning (subject, html)"""
+    global _digest_template
+    if _digest_template is None:
+        _digest_template = app.jinja_env.get_template('email/due_digest.html')
+    now = now or datetime.now()
+    task_count = len(tasks)
+    subject = f"📋 {task_count} Task{'s' if task_count > 1 else ''} Due Today - {now.strftime('%B %d, %Y')}"
+    html_body = _digest_template.render(
+        tasks=tasks,
+        date_label=now.strftime('%A, %B %d, %Y'),
+        priority_colors=PRIORITY_COLORS,
+        priority_labels=PRIORITY_LABELS,
+    )
+    return subject, html_body
+
+@scheduled_job('due_tasks', interval=float(os.environ.get('DUE_TASKS_INTERVAL', 3600)))
+def check_due_tasks():
+    """Check for tasks due today and queue a digest email; returns the number of tasks"""
+    if not email_ready(get_email_config()):
+        return 0
+    
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        today = datetime.now().date()
         
-        print(f"EMAIL: Successfully sent: {subject}")
-        return True
+        # Claim tasks due today that haven't been notified yet. The rows are
+        # marked and the digest queued in one transaction, and SKIP LOCKED
+        # keeps a concurrent scan from claiming the same tasks.
+        cur.execute('''
+            WITH due AS (
+                SELECT id FROM todos
+                WHERE due_date = %s
+                AND completed = FALSE
+                AND (last_notified IS NULL OR last_notified != %s)
+                FOR UPDATE SKIP LOCKED
+            ), claimed AS (
+                UPDATE todos t
+                SET last_notified = %s
+                FROM due
+                WHERE t.id = due.id
+                RETURNING t.*
+            )
+            SELECT claimed.*, c.name as category_name, c.color as category_color
+            FROM claimed
+            LEFT JOIN categories c ON claimed.category_id = c.id
+            ORDER BY claimed.priority DESC, claimed.created_at ASC
+        ''', (today, today, today))
+        due_tasks = cur.fetchall()
         
-    except Exception as e:
-        print(f"EMAIL: Error sending notification - {e}")
-        return False
+        if due_tasks:
+            subject, html_body = render_due_digest(due_tasks)
+            enqueue_email(cur, subject, html_body)
+        conn.commit()
+    
+    if due_tasks and os.environ.get('EMAIL_WORKER', 'thread').lower() == 'thread':
+        email_worker.start()
+    return len(due_tasks)
 
-def check_due_tasks():
-    """Check for tasks due today and send notifications"""
-    try:
-        with get_db_connection() as conn:
-            cur = conn.cursor()
-            today = datetime.now().date().strftime('%Y-%m-%d')
+@scheduled_job('send_emails', interval=EMAIL_POLL_INTERVAL)
+def send_queued_emails():
+    """Deliver anything left in the outbox"""
+    worker = EmailWorker()
+    worker.run(once=True)
+    return worker.sent
+
+# Advisory lock namespace for jobs; the second key is hashtext(job name)
+JOB_LOCK_NAMESPACE = 727002
+JOB_RUNS_RETENTION_DAYS = int(os.environ.get('JOB_RUNS_RETENTION_DAYS', 30))
+
+def run_job(name, force=False):
+    """Run one registered job if no other instance holds its lock.
+
+    Unless forced, the job is skipped when it last succeeded less than its
+    interval ago. Returns the job's result, or None if it was skipped.
+    Every run is recorded in job_runs with its duration, and the job's runs
+    older than JOB_RUNS_RETENTION_DAYS are pruned.
+    """
+    func, interval = JOBS[name]
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT pg_try_advisory_lock(%s, hashtext(%s)) AS locked', (JOB_LOCK_NAMESPACE, name))
+        locked = cur.fetchone()['locked']
+        conn.commit()
+        if not locked:
+            return None
+        try:
+            if not force:
+                cur.execute('''
+                    SELECT 1 FROM job_runs
+                    WHERE job_name = %s AND status = 'ok'
+                    AND started_at > LOCALTIMESTAMP - make_interval(secs => %s)
+                    LIMIT 1
+                ''', (name, interval))
+                recent = cur.fetchone()
+                conn.commit()
+                if recent:
+                    return None
+            
+            # Run times come from the database clock, which the interval check uses
+            cur.execute('SELECT LOCALTIMESTAMP AS now')
+            started_at = cur.fetchone()['now']
+            conn.commit()
+            started = time.perf_counter()
+            status, error, result = 'ok', None, None
+            try:
+                result = func()
+            except Exception as e:
+                status, error = 'error', str(e)
+                print(f"Job {name} failed: {e}")
+            duration_ms = (time.perf_counter() - started) * 1000
+            JOB_DURATION.labels(name, status).observe(duration_ms / 1000)
             
-            # Get tasks due today that haven't been notified yet
             cur.execute('''
-                SELECT t.*, c.name as category_name, c.color as category_color
-                FROM todos t
-                LEFT JOIN categories c ON t.category_id = c.id
-                WHERE t.due_date = %s 
-                AND t.completed = FALSE 
-                AND (t.last_notified IS NULL OR t.last_notified != %s)
-                ORDER BY t.priority DESC, t.created_at ASC
-            ''', (today, today))
-            
-            due_tasks = cur.fetchall()
-            
-            if due_tasks:
-                # Create email content
-                task_count = len(due_tasks)
-                subject = f"📋 {task_count} Task{'s' if task_count > 1 else ''} Due Today - {datetime.now().strftime('%B %d, %Y')}"
-                
-                # Create HTML email body
-                html_body = f"""
-                <html>
-                <body style="font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', system-ui, sans-serif; color: #333; max-width: 600px; margin: 0 auto;">
-                    <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 20px; border-radius: 10px 10px 0 0;">
-                        <h1 style="margin: 0; font-size: 24px;">📋 Tasks Due Today</h1>
-                        <p style="margin: 10px 0 0 0; opacity: 0.9;">{datetime.now().strftime('%A, %B %d, %Y')}</p>
-                    </div>
-                    <div style="background: #f8f9fa; padding: 20px; border-radius: 0 0 10px 10px;">
-                        <p style="margin-top: 0;">You have <strong>{task_count}</strong> task{'s' if task_count > 1 else ''} due today:</p>
-                """
-                
-                for task in due_tasks:
-                    priority_colors = {1: '#f59e0b', 2: '#ef4444', 3: '#dc2626'}
-                    priority_labels = {1: 'Low', 2: 'Medium', 3: 'High'}
-                    
-                    html_body += f"""
-                        <div style="background: white; margin: 10px 0; padding: 15px; border-radius: 8px; border-left: 4px solid {priority_colors.get(task['priority'], '#667eea')};">
-                            <div style="display: flex; align-items: center; justify-content: space-between; margin-bottom: 8px;">
-                                <h3 style="margin: 0; color: #333;">{task['task']}</h3>
-                                <span style="background: {priority_colors.get(task['priority'], '#667eea')}; color: white; padding: 2px 8px; border-radius: 12px; font-size: 12px; font-weight: bold;">
-                                    {priority_labels.get(task['priority'], 'Medium')}
-                                </span>
-                            </div>
-                    """
-                    
-                    if task['description']:
-                        html_body += f"<p style='margin: 8px 0; color: #666; font-size: 14px;'>{task['description']}</p>"
-                    
-                    if task['category_name']:
-                        html_body += f"<span style='background: {task['category_color']}; color: white; padding: 4px 8px; border-radius: 12px; font-size: 12px;'>{task['category_name']}</span>"
-                    
-                    html_body += "</div>"
-                
-                html_body += """
-                        <p style="margin-top: 20px; color: #666; font-size: 14px;">
-                            💡 <strong>Tip:</strong> Open your Todo Dashboard to manage these tasks!
-                        </p>
-                    </div>
-                </body>
-                </html>
-                """
-                
-                # Send email
-                if send_email_notification(subject, html_body):
-                    # Mark tasks as notified
-                    for task in due_tasks:
-                        cur.execute('UPDATE todos SET last_notified = %s WHERE id = %s', (today, task['id']))
-                    conn.commit()
-                    
-    except Exception as e:
-        print(f"Error checking due tasks: {e}")
+                INSERT INTO job_runs (job_name, started_at, duration_ms, status, error)
+                VALUES (%s, %s, %s, %s, %s)
+            ''', (name, started_at, duration_ms, status, error))
+            cur.execute('''
+                DELETE FROM job_runs
+                WHERE job_name = %s AND started_at < LOCALTIMESTAMP - make_interval(days => %s)
+            ''', (name, JOB_RUNS_RETENTION_DAYS))
+            conn.commit()
+            print(f"Job {name} finished in {duration_ms:.1f}ms ({status})")
+            return result
+        finally:
+            conn.rollback()
+            cur.execute('SELECT pg_advisory_unlock(%s, hashtext(%s))', (JOB_LOCK_NAMESPACE, name))
+            conn.commit()
+
+def run_jobs(force=False):
+    """Run every registered job that is due"""
+    return {name: run_job(name, force=force) for name in JOBS}
+
+SCHEDULER_TICK = float(os.environ.get('SCHEDULER_TICK', 60))
+
+_scheduler_thread = None
+_scheduler_pid = None
+
+def start_scheduler():
+    """Run jobs from a background timer thread in this process"""
+    global _scheduler_thread, _scheduler_pid
+    if _scheduler_thread is not None and _scheduler_pid == os.getpid() and _scheduler_thread.is_alive():
+        return
+    
+    def loop():
+        while True:
+            try:
+                run_jobs()
+            except Exception as e:
+                print(f"Scheduler error: {e}")
+            time.sleep(SCHEDULER_TICK)
+    
+    _scheduler_pid = os.getpid()
+    _scheduler_thread = threading.Thread(target=loop, name='scheduler', daemon=True)
+    _scheduler_thread.start()
+
+# Columns shared by the hot and archive tables, in table order
+TODO_COLUMNS = ('id, task, description, completed, priority, due_date, category_id, '
+                'created_at, updated_at, last_notified, subtask_seq')
+SUBTASK_COLUMNS = 'id, todo_id, title, completed, order_index, created_at'
+NOTE_COLUMNS = 'id, todo_id, note_type, content, created_at'
+
+# Hot and archived rows together, for reads that span both (ids never overlap)
+ALL_TODOS = f'''(
+    SELECT {TODO_COLUMNS}, NULL::timestamp AS archived_at FROM todos
+    UNION ALL
+    SELECT {TODO_COLUMNS}, archived_at FROM todos_archive
+)'''
+ALL_SUBTASKS = f'(SELECT {SUBTASK_COLUMNS} FROM subtasks UNION ALL SELECT {SUBTASK_COLUMNS} FROM subtasks_archive)'
+ALL_NOTES = f'(SELECT {NOTE_COLUMNS} FROM task_notes UNION ALL SELECT {NOTE_COLUMNS} FROM task_notes_archive)'
+
+# Todo rows joined with their category and subtask progress (0-100)
+TODO_LIST_TEMPLATE = '''
+    SELECT t.*, c.name as category_name, c.color as category_color,
+           COALESCE(p.subtask_progress, 0) as subtask_progress
+    FROM {todos} t
+    LEFT JOIN categories c ON t.category_id = c.id
+    LEFT JOIN LATERAL (
+        SELECT (100.0 * COUNT(*) FILTER (WHERE s.completed) / NULLIF(COUNT(*), 0))::float AS subtask_progress
+        FROM {subtasks} s
+        WHERE s.todo_id = t.id
+    ) p ON TRUE
+'''
+TODO_LIST_SELECT = TODO_LIST_TEMPLATE.format(todos='todos', subtasks='subtasks')
+# The completed tab also lists archived todos
+COMPLETED_LIST_SELECT = TODO_LIST_TEMPLATE.format(todos=ALL_TODOS, subtasks=ALL_SUBTASKS)
+
+TODO_PAGE_SIZE = int(os.environ.get('TODO_PAGE_SIZE', 50))
+
+# Sort keys for the active tab: priority rank, due date (undated last), then
+# newest first. Keyset cursors compare against these same expressions.
+ACTIVE_PRIORITY_RANK = 'CASE t.priority WHEN 3 THEN 1 WHEN 2 THEN 2 WHEN 1 THEN 3 ELSE 4 END'
+ACTIVE_DUE_KEY = "COALESCE(t.due_date, 'infinity'::date)"
+
+def encode_cursor(values):
+    """Encode keyset values into an opaque URL-safe cursor"""
+    raw = json.dumps(values, default=lambda v: v.isoformat())
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, length):
+    """Decode a cursor produced by encode_cursor, raising ValueError if malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError("Invalid cursor")
+    return values
+
+NOTES_PAGE_SIZE = int(os.environ.get('NOTES_PAGE_SIZE', 20))
+
+# Queries shared with the async server (asgi.py) are built by *_query()
+# functions returning (sql, params), with the rows shaped by *_result().
+# Cursor values are bound as text so either driver can pass them through.
+
+def notes_query(todo_id, before=None, limit=NOTES_PAGE_SIZE, archived=False):
+    """SQL for a page of a todo's notes, newest first"""
+    table = 'task_notes_archive' if archived else 'task_notes'
+    params = [todo_id]
+    where = 'todo_id = %s'
+    if before:
+        created_at, note_id = decode_cursor(before, 2)
+        where += ' AND (created_at, id) < (%s::text::timestamp, %s)'
+        params += [created_at, note_id]
+    return f'''
+        SELECT * FROM {table} WHERE {where}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s
+    ''', params + [limit + 1]
+
+def notes_result(notes, limit=NOTES_PAGE_SIZE):
+    """Trim a notes page to limit; returns (notes, next_cursor)"""
+    next_cursor = None
+    if len(notes) > limit:
+        notes = notes[:limit]
+        next_cursor = encode_cursor([notes[-1]['created_at'], notes[-1]['id']])
+    return notes, next_cursor
+
+def fetch_notes(cur, todo_id, before=None, limit=NOTES_PAGE_SIZE, archived=False):
+    """Fetch a page of a todo's notes, newest first; returns (notes, next_cursor)"""
+    cur.execute(*notes_query(todo_id, before, limit, archived))
+    return notes_result(cur.fetchall(), limit)
+
+def todo_sort_key(tab, todo):
+    """Keyset values of a todo for the given dashboard tab"""
+    if tab == 'completed':
+        return [todo['updated_at'], todo['id']]
+    rank = {3: 1, 2: 2, 1: 3}.get(todo['priority'], 4)
+    return [rank, todo['due_date'] or 'infinity', todo['created_at'], todo['id']]
+
+def todo_page_query(tab, after=None, limit=TODO_PAGE_SIZE):
+    """SQL for one page of a dashboard tab using keyset pagination.
+
+    ``after`` is the cursor returned with the previous page.
+    ``limit=None`` fetches everything.
+    """
+    params = []
+    if tab == 'completed':
+        where = 't.completed = TRUE'
+        if after:
+            where += ' AND (t.updated_at, t.id) < (%s::text::timestamp, %s)'
+            params += decode_cursor(after, 2)
+        order = 't.updated_at DESC, t.id DESC'
+    else:
+        where = 't.completed = FALSE'
+        if after:
+            rank, due, created_at, todo_id = decode_cursor(after, 4)
+            # The leading >= is an index condition; the OR breaks ties on the
+            # descending created_at/id columns
+            where += f'''
+                AND ({ACTIVE_PRIORITY_RANK}, {ACTIVE_DUE_KEY}) >= (%s, %s::text::date)
+                AND (({ACTIVE_PRIORITY_RANK}, {ACTIVE_DUE_KEY}) > (%s, %s::text::date)
+                     OR (t.created_at, t.id) < (%s::text::timestamp, %s))
+            '''
+            params += [rank, due, rank, due, created_at, todo_id]
+        order = f'{ACTIVE_PRIORITY_RANK}, {ACTIVE_DUE_KEY}, t.created_at DESC, t.id DESC'
+    
+    select = COMPLETED_LIST_SELECT if tab == 'completed' else TODO_LIST_SELECT
+    sql = select + f' WHERE {where} ORDER BY {order}'
+    if limit is not None:
+        sql += ' LIMIT %s'
+        params.append(limit + 1)
+    return sql, params
+
+def todo_page_result(tab, rows, limit=TODO_PAGE_SIZE):
+    """Trim a page to limit; returns (rows, next_cursor), the cursor None on the last page"""
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(todo_sort_key(tab, rows[-1]))
+    return rows, next_cursor
+
+def fetch_todo_page(cur, tab, after=None, limit=TODO_PAGE_SIZE):
+    """Fetch one page of a dashboard tab with subtasks attached; returns (todos, next_cursor)"""
+    cur.execute(*todo_page_query(tab, after, limit))
+    rows, next_cursor = todo_page_result(tab, cur.fetchall(), limit)
+    return attach_subtasks(cur, rows), next_cursor
+
+def subtasks_query(todos):
+    """SQL for the subtasks of a list of todos"""
+    source = ALL_SUBTASKS if any(todo.get('archived_at') for todo in todos) else 'subtasks'
+    return f'''
+        SELECT * FROM {source} s WHERE todo_id = ANY(%s) ORDER BY todo_id, order_index, id
+    ''', [[todo['id'] for todo in todos]]
+
+def subtasks_result(todos, subtasks):
+    """Return todos as dicts, each with its subtasks"""
+    subtasks_by_todo = {}
+    for subtask in subtasks:
+        subtasks_by_todo.setdefault(subtask['todo_id'], []).append(subtask)
+    
+    todos = [dict(todo) for todo in todos]
+    for todo in todos:
+        todo['subtasks'] = subtasks_by_todo.get(todo['id'], [])
+    return todos
+
+def attach_subtasks(cur, todos):
+    """Return todos as dicts with their subtasks, fetched in a single query"""
+    if not todos:
+        return []
+    cur.execute(*subtasks_query(todos))
+    return subtasks_result(todos, cur.fetchall())
+
+# One todo, live or archived, shaped like a list row
+TODO_BY_ID = COMPLETED_LIST_SELECT + ' WHERE t.id = %s'
+
+def fetch_todo(cur, todo_id):
+    """One todo, live or archived, shaped like a list row with its subtasks"""
+    cur.execute(TODO_BY_ID, (todo_id,))
+    row = cur.fetchone()
+    return attach_subtasks(cur, [row])[0] if row else None
+
+# /api/todos?ids=... refreshes the todos named by one change event, which
+# lists at most 200 ids (see notify_todo_event)
+TODOS_BY_IDS = COMPLETED_LIST_SELECT + ' WHERE t.id = ANY(%s)'
+TODO_IDS_MAX = 200
+
+def parse_todo_ids(value):
+    """Parse a comma-separated ids parameter, raising ValueError when it is invalid"""
+    try:
+        ids = [int(part) for part in value.split(',') if part.strip()]
+    except ValueError:
+        raise ValueError('ids must be comma-separated integers')
+    if not 0 < len(ids) <= TODO_IDS_MAX:
+        raise ValueError(f'ids must list between 1 and {TODO_IDS_MAX} todos')
+    return list(dict.fromkeys(ids))
+
+def todo_items(ids, todos, render_card):
+    """One entry per requested id, with todo and html None for todos that are gone"""
+    by_id = {todo['id']: todo for todo in todos}
+    return [{'id': todo_id, 'todo': by_id.get(todo_id),
+             'html': render_card(by_id[todo_id]) if todo_id in by_id else None}
+            for todo_id in ids]
+
+# Summary key for a todo row; must match apply_todo_stats() from migration 13
+TODO_STATS_KEY = '''
+    COALESCE(category_id, 0) AS category_key,
+    COALESCE(priority, 0) AS priority_key,
+    completed
+'''
+
+# Open todos due before a date, read index-only from todos_open_due_stats_idx
+OVERDUE_TODOS = 'SELECT category_id, priority FROM todos WHERE completed = FALSE AND due_date < %s'
+
+TODO_COUNTS_SQL = f'''
+    SELECT s.total, s.completed, o.overdue
+    FROM (
+        SELECT COALESCE(SUM(todo_count), 0)::bigint AS total,
+               COALESCE(SUM(todo_count) FILTER (WHERE completed), 0)::bigint AS completed
+        FROM todo_stats_summary
+    ) s, (
+        SELECT COUNT(*)::bigint AS overdue FROM ({OVERDUE_TODOS}) t
+    ) o
+'''
+
+def todo_counts_result(row):
+    """Dashboard counters from a TODO_COUNTS_SQL row"""
+    return {
+        'total': row['total'],
+        'completed': row['completed'],
+        'pending': row['total'] - row['completed'],
+        'overdue': row['overdue']
+    }
+
+def get_todo_counts(cur):
+    """Dashboard counters summed from todo_stats_summary"""
+    cur.execute(TODO_COUNTS_SQL, (datetime.now().date(),))
+    return todo_counts_result(cur.fetchone())
+
+@scheduled_job('stats_reconcile', interval=float(os.environ.get('STATS_RECONCILE_INTERVAL', 86400)))
+def reconcile_todo_stats():
+    """Rebuild todo_stats_summary from todos and the archive; returns the drift that was corrected"""
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        # Writers queue behind this lock in their triggers, so changes they
+        # make while the rebuild runs are applied on top of it afterwards
+        cur.execute('LOCK TABLE todo_stats_summary IN SHARE ROW EXCLUSIVE MODE')
+        cur.execute(ALLOW_SEQSCAN + f'''
+            WITH actual AS (
+                SELECT {TODO_STATS_KEY}, COUNT(*) AS todo_count
+                FROM {ALL_TODOS} t GROUP BY 1, 2, 3
+            )
+            SELECT COUNT(*) AS drifted_keys,
+                   COALESCE(SUM(ABS(COALESCE(a.todo_count, 0) - COALESCE(s.todo_count, 0))), 0)::bigint AS drifted_todos
+            FROM actual a
+            FULL JOIN todo_stats_summary s USING (category_key, priority_key, completed)
+            WHERE COALESCE(a.todo_count, 0) <> COALESCE(s.todo_count, 0)
+        ''')
+        drift = dict(cur.fetchone())
+        if drift['drifted_keys']:
+            cur.execute('DELETE FROM todo_stats_summary')
+            cur.execute(ALLOW_SEQSCAN + f'''
+                INSERT INTO todo_stats_summary (category_key, priority_key, completed, todo_count)
+                SELECT {TODO_STATS_KEY}, COUNT(*) FROM {ALL_TODOS} t GROUP BY 1, 2, 3
+            ''')
+            # The corrected counts change /api/todo_stats, so move its ETag on
+            cur.execute("UPDATE data_versions SET version = version + 1 WHERE name = 'todos'")
+            print(f"Stats summary drifted on {drift['drifted_keys']} key(s) "
+                  f"({drift['drifted_todos']} todos); rebuilt")
+        conn.commit()
+        return drift
+
+# Activity entries older than ACTIVITY_RETENTION_DAYS are collapsed into one
+# 'summary' note per todo and day; user notes are never touched.
+ACTIVITY_RETENTION_DAYS = int(os.environ.get('ACTIVITY_RETENTION_DAYS', 30))
+COMPACT_BATCH_SIZE = int(os.environ.get('COMPACT_BATCH_SIZE', 200))
+ACTIVITY_SUMMARY_MAX = 1000
+
+@scheduled_job('compact_activity', interval=float(os.environ.get('COMPACT_ACTIVITY_INTERVAL', 86400)))
+def compact_activity():
+    """Collapse old activity notes into per-day summaries; returns the number of rows removed"""
+    # Whole days only: a cutoff mid-day would leave that day's later entries
+    # to be summarized again by the next run
+    cutoff = datetime.combine(date.today() - timedelta(days=ACTIVITY_RETENTION_DAYS), datetime.min.time())
+    removed = 0
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        while True:
+            # Whole todos per batch, so each day ends up with a single summary
+            cur.execute('''
+                WITH targets AS (
+                    SELECT DISTINCT todo_id FROM task_notes
+                    WHERE note_type = 'activity' AND created_at < %s
+                    LIMIT %s
+                ), compacted AS (
+                    DELETE FROM task_notes n
+                    USING targets t
+                    WHERE n.todo_id = t.todo_id AND n.note_type = 'activity' AND n.created_at < %s
+                    RETURNING n.todo_id, n.created_at, n.id, n.content
+                ), summaries AS (
+                    INSERT INTO task_notes (todo_id, note_type, content, created_at)
+                    SELECT todo_id, 'summary',
+                           left(COUNT(*) || ' updates: ' || string_agg(content, '; ' ORDER BY created_at, id), %s),
+                           MAX(created_at)
+                    FROM compacted
+                    GROUP BY todo_id, created_at::date
+                )
+                SELECT COUNT(*) AS removed FROM compacted
+            ''', (cutoff, COMPACT_BATCH_SIZE, cutoff, ACTIVITY_SUMMARY_MAX))
+            batch = cur.fetchone()['removed']
+            conn.commit()
+            if not batch:
+                return removed
+            removed += batch
+
+# Todos completed more than ARCHIVE_AFTER_DAYS ago move, with their subtasks
+# and notes, to the *_archive tables so the hot tables stay small
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 30))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 500))
+
+def move_todos(cur, ids, restore=False):
+    """Move todos and their children between the hot and archive tables; returns the moved ids"""
+    for table, columns, key in (('todos', TODO_COLUMNS, 'id'),
+                                ('subtasks', SUBTASK_COLUMNS, 'todo_id'),
+                                ('task_notes', NOTE_COLUMNS, 'todo_id')):
+        source, target = (table + '_archive', table) if restore else (table, table + '_archive')
+        cur.execute(f'''
+            INSERT INTO {target} ({columns})
+            SELECT {columns} FROM {source} WHERE {key} = ANY(%s)
+        ''', (ids,))
+    # Deleting the parents cascades to the copied children
+    cur.execute(f"DELETE FROM {'todos_archive' if restore else 'todos'} WHERE id = ANY(%s) RETURNING id", (ids,))
+    return [row['id'] for row in cur.fetchall()]
+
+@scheduled_job('archive_todos', interval=float(os.environ.get('ARCHIVE_INTERVAL', 86400)))
+def archive_completed_todos():
+    """Archive long-completed todos in batches; returns how many were moved"""
+    cutoff = datetime.now() - timedelta(days=ARCHIVE_AFTER_DAYS)
+    archived = 0
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        while True:
+            # Row locks keep concurrent edits and new children off a todo mid-move
+            cur.execute('''
+                SELECT id FROM todos
+                WHERE completed = TRUE AND updated_at < %s
+                ORDER BY updated_at DESC, id DESC
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ''', (cutoff, ARCHIVE_BATCH_SIZE))
+            ids = [row['id'] for row in cur.fetchall()]
+            if not ids:
+                conn.commit()
+                return archived
+            archived += len(move_todos(cur, ids))
+            conn.commit()
+
+def wants_json():
+    """True when the client asked for JSON rather than a redirect"""
+    return request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
+def todo_payload(cur, todo_id):
+    """JSON body with a todo (None once it is gone), its rendered card and the dashboard counters"""
+    todo = fetch_todo(cur, todo_id)
+    html = None
+    if todo:
+        html = render_template('_todo_item.html', todo=todo, today=datetime.now().date().strftime('%Y-%m-%d'))
+    return {'id': todo_id, 'todo': todo, 'html': html, 'counts': get_todo_counts(cur)}
 
 def login_required(f):
     """Decorator to check if user is logged in"""
@@ -329,6 +1955,112 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Conditional GET: pages are tagged with the data_versions of the tables they
+# read, so an unchanged page answers 304 before any heavy query or render.
+API_CACHE_MAX_AGE = int(os.environ.get('API_CACHE_MAX_AGE', 5))
+ETAG_SALT = os.environ.get('APP_VERSION', os.environ.get('VERCEL_GIT_COMMIT_SHA', ''))
+
+def get_data_versions(cur, tables):
+    """Return {table: version} for the given tables"""
+    cur.execute('SELECT name, version FROM data_versions WHERE name = ANY(%s)', (list(tables),))
+    return {row['name']: row['version'] for row in cur.fetchall()}
+
+def conditional(*tables, max_age=None):
+    """Tag a GET view with an ETag built from the tables it reads and answer 304 when unchanged.
+
+    With max_age the response may be reused without revalidation for that
+    many seconds; otherwise browsers revalidate on every visit.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            # A pending flash message must be shown, and must not end up in a cached page
+            if '_flashes' in session:
+                return f(*args, **kwargs)
+            try:
+                with get_db_connection() as conn:
+                    versions = get_data_versions(conn.cursor(), tables)
+            except Exception:
+                return f(*args, **kwargs)
+            
+            key = json.dumps([ETAG_SALT, request.endpoint, kwargs, sorted(request.args.items(multi=True)),
+                              date.today().isoformat(), versions], default=str)
+            etag = hashlib.sha1(key.encode()).hexdigest()
+            cache_control = f'private, max-age={max_age}' if max_age else 'private, no-cache'
+            if etag in request.if_none_match:
+                response = Response(status=304)
+            else:
+                response = app.make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = cache_control
+            return response
+        return decorated_function
+    return decorator
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def report_query_stats(response):
+    """Attach Server-Timing headers and log the request's query profile"""
+    stats = g.get('query_stats')
+    started = g.get('request_started')
+    if started is None:
+        return response
+    total_ms = (time.perf_counter() - started) * 1000
+    endpoint = request.endpoint or 'unmatched'
+    REQUEST_LATENCY.labels(endpoint, request.method).observe(total_ms / 1000)
+    REQUEST_DB_QUERIES.labels(endpoint).observe(stats['count'] if stats else 0)
+    
+    timings = [f'app;dur={total_ms:.2f}']
+    if stats:
+        timings.insert(0, f'db;dur={stats["time_ms"]:.2f};desc="{stats["count"]} queries"')
+    response.headers.add('Server-Timing', ', '.join(timings))
+    if not stats:
+        return response
+    
+    statements = stats['statements']
+    slowest = sorted(statements.items(), key=lambda item: item[1]['max_ms'], reverse=True)[:3]
+    repeated = [(sql, entry['count']) for sql, entry in statements.items() if entry['count'] > N_PLUS_ONE_THRESHOLD]
+    record = {
+        'event': 'request',
+        'method': request.method,
+        'endpoint': request.endpoint,
+        'path': request.path,
+        'status': response.status_code,
+        'duration_ms': round(total_ms, 2),
+        'db_queries': stats['count'],
+        'db_time_ms': round(stats['time_ms'], 2),
+        'slowest': [{'sql': log_sql(sql), 'ms': round(entry['max_ms'], 2)} for sql, entry in slowest],
+    }
+    query_logger.info(json.dumps(record))
+    
+    for sql, entry in slowest:
+        if entry['max_ms'] >= SLOW_QUERY_MS:
+            query_logger.warning(json.dumps({'event': 'slow_query', 'endpoint': request.endpoint,
+                                             'ms': round(entry['max_ms'], 2), 'sql': log_sql(sql)}))
+    for sql, count in repeated:
+        query_logger.warning(json.dumps({'event': 'n_plus_one', 'endpoint': request.endpoint,
+                                         'count': count, 'sql': log_sql(sql)}))
+    return response
+
+@app.before_request
+def check_schema():
+    """Make sure migrations have run before the first database request"""
+    if request.endpoint in (None, 'static', 'login', 'logout', 'metrics'):
+        return None
+    try:
+        if SCHEMA_CHECK != 'off':
+            ensure_schema()
+    except Exception as e:
+        return f'<h2>Database Error</h2><p>{str(e)}</p><p>Check your DATABASE_URL environment variable.</p><a href="/login">Login</a>', 500
+    if os.environ.get('SCHEDULER_THREAD', 'false').lower() == 'true':
+        start_scheduler()
+    return None
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     """Login page with quirky messages"""
@@ -364,102 +2096,576 @@ def logout():
 
 @app.route('/')
 @login_required
+@conditional('todos', 'subtasks', 'categories', 'todos_archive', 'subtasks_archive')
 def dashboard():
     """Main dashboard with todo overview"""
     try:
-        # Initialize database if needed
-        init_db()
-        
         with get_db_connection() as conn:
             cur = conn.cursor()
             tab = request.args.get('tab', 'active')  # Default to active tab
             view = request.args.get('view', 'list')  # list or calendar
             
-            if tab == 'completed':
-                # Get completed todos
-                cur.execute('''
-                    SELECT t.*, c.name as category_name, c.color as category_color
-                    FROM todos t
-                    LEFT JOIN categories c ON t.category_id = c.id
-                    WHERE t.completed = TRUE
-                    ORDER BY t.updated_at DESC
-                ''')
-            else:
-                # Get active todos
-                cur.execute('''
-                    SELECT t.*, c.name as category_name, c.color as category_color
-                    FROM todos t
-                    LEFT JOIN categories c ON t.category_id = c.id
-                    WHERE t.completed = FALSE
-                    ORDER BY 
-                        CASE t.priority 
-                            WHEN 3 THEN 1 
-                            WHEN 2 THEN 2 
-                            WHEN 1 THEN 3 
-                        END,
-                        t.due_date ASC NULLS LAST,
-                        t.created_at DESC
-                ''')
-            
-            todos = cur.fetchall()
-            
-            # Get subtasks for each todo
-            todos_with_subtasks = []
-            for todo in todos:
-                cur.execute('''
-                    SELECT * FROM subtasks WHERE todo_id = %s ORDER BY order_index, id
-                ''', (todo['id'],))
-                subtasks = cur.fetchall()
-                
-                todo_dict = dict(todo)
-                todo_dict['subtasks'] = subtasks
-                todo_dict['subtask_progress'] = len([s for s in subtasks if s['completed']]) / len(subtasks) * 100 if subtasks else 0
-                todos_with_subtasks.append(todo_dict)
-            
             # Get categories
-            cur.execute('SELECT * FROM categories ORDER BY name')
-            categories = cur.fetchall()
+            categories = get_categories(cur)
             
             # Get stats (always for all todos)
-            cur.execute('SELECT * FROM todos')
-            all_todos = cur.fetchall()
-            total_todos = len(all_todos)
-            completed_todos = len([t for t in all_todos if t['completed']])
-            pending_todos = total_todos - completed_todos
-            overdue_todos = len([t for t in all_todos if not t['completed'] and t['due_date'] and t['due_date'] < datetime.now().date()])
+            stats = get_todo_counts(cur)
             
             # Get today's date for overdue comparison
             today = datetime.now().date().strftime('%Y-%m-%d')
             
             if view == 'calendar':
+                # The calendar fetches its visible range from /api/calendar
                 return render_template('calendar.html',
-                                     todos=todos_with_subtasks,
                                      categories=categories,
                                      today=today,
                                      current_tab=tab,
                                      current_view=view,
-                                     stats={
-                                         'total': total_todos,
-                                         'completed': completed_todos,
-                                         'pending': pending_todos,
-                                         'overdue': overdue_todos
-                                     })
+                                     stats=stats)
+            
+            todos_with_subtasks, next_cursor = fetch_todo_page(cur, tab)
             
             return render_template('dashboard.html', 
                                  todos=todos_with_subtasks, 
+                                 next_cursor=next_cursor,
                                  categories=categories,
                                  today=today,
                                  current_tab=tab,
                                  current_view=view,
-                                 stats={
-                                     'total': total_todos,
-                                     'completed': completed_todos,
-                                     'pending': pending_todos,
-                                     'overdue': overdue_todos
-                                 })
+                                 stats=stats)
                                  
     except Exception as e:
-        return f'<h2>Database Error</h2><p>{str(e)}</p><p>Check your DATABASE_URL environment variable.</p><a href="/login">Login</a>'
+        return f'<h2>Database Error</h2><p>{str(e)}</p><p>Check your DATABASE_URL environment variable.</p><a href="/login">Login</a>', 500
+
+@app.route('/api/todos')
+@login_required
+def api_todos():
+    """API endpoint returning the next page of a dashboard tab, or the todos listed in ids"""
+    tab = request.args.get('tab', 'active')
+    try:
+        if 'ids' in request.args:
+            ids = parse_todo_ids(request.args['ids'])
+            with get_db_connection() as conn:
+                cur = conn.cursor()
+                cur.execute(TODOS_BY_IDS, (ids,))
+                todos = attach_subtasks(cur, cur.fetchall())
+                counts = get_todo_counts(cur)
+            today = datetime.now().date().strftime('%Y-%m-%d')
+            items = todo_items(ids, todos, lambda todo: render_template('_todo_item.html', todo=todo, today=today))
+            return jsonify({'items': items, 'counts': counts})
+        
+        limit = min(max(int(request.args.get('limit', TODO_PAGE_SIZE)), 1), 200)
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+            todos, next_cursor = fetch_todo_page(cur, tab, after=request.args.get('after'), limit=limit)
+            counts = get_todo_counts(cur)
+        
+        html = render_template_string(
+            "{% for todo in todos %}{% include '_todo_item.html' %}{% endfor %}",
+            todos=todos, today=datetime.now().date().strftime('%Y-%m-%d'))
+        return jsonify({'todos': todos, 'html': html, 'next_cursor': next_cursor, 'counts': counts})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+CALENDAR_MAX_DAYS = 62
+
+def calendar_query(tab, start, end, per_day):
+    """SQL for todos due between start and end, ranked within each day"""
+    source = ALL_TODOS if tab == 'completed' else 'todos'
+    return f'''
+        SELECT * FROM (
+            SELECT t.id, t.task, t.priority, t.completed, t.due_date,
+                   c.name as category_name, c.color as category_color,
+                   ROW_NUMBER() OVER (PARTITION BY t.due_date ORDER BY t.priority DESC, t.created_at, t.id) AS day_rank,
+                   COUNT(*) OVER (PARTITION BY t.due_date) AS day_count
+            FROM {source} t
+            LEFT JOIN categories c ON t.category_id = c.id
+            WHERE t.completed = %s AND t.due_date BETWEEN %s AND %s
+        ) ranked
+        WHERE day_rank <= %s
+        ORDER BY due_date, day_rank
+    ''', [tab == 'completed', start, end, per_day]
+
+def calendar_result(rows):
+    """Group calendar rows by due date, keeping the top per_day tasks each"""
+    days = {}
+    for row in rows:
+        day = days.setdefault(row['due_date'].isoformat(), {'count': row['day_count'], 'tasks': []})
+        day['tasks'].append({
+            'id': row['id'],
+            'task': row['task'],
+            'priority': row['priority'],
+            'completed': row['completed'],
+            'category_name': row['category_name'],
+            'category_color': row['category_color'],
+        })
+    return days
+
+def fetch_calendar_days(cur, tab, start, end, per_day):
+    """Todos due between start and end, grouped by day with the top per_day tasks each"""
+    cur.execute(*calendar_query(tab, start, end, per_day))
+    return calendar_result(cur.fetchall())
+
+@app.route('/api/calendar')
+@login_required
+def api_calendar():
+    """API endpoint returning todos for a date range, bucketed by due date"""
+    tab = request.args.get('tab', 'active')
+    try:
+        start = datetime.strptime(request.args.get('start', ''), '%Y-%m-%d').date()
+        end = datetime.strptime(request.args.get('end', ''), '%Y-%m-%d').date()
+        per_day = min(max(int(request.args.get('per_day', 3)), 1), 100)
+    except ValueError:
+        return jsonify({'error': 'start and end must be YYYY-MM-DD dates'}), 400
+    if end < start or (end - start).days >= CALENDAR_MAX_DAYS:
+        return jsonify({'error': f'Date range must be between 1 and {CALENDAR_MAX_DAYS} days'}), 400
+    
+    try:
+        with get_db_connection() as conn:
+            days = fetch_calendar_days(conn.cursor(), tab, start, end, per_day)
+        return jsonify({'start': start.isoformat(), 'end': end.isoformat(), 'days': days})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Search documents; these must stay identical to the index expressions in migration 6
+TODO_SEARCH_DOC = ("setweight(to_tsvector('english', coalesce(task, '')), 'A') || "
+                   "setweight(to_tsvector('english', coalesce(description, '')), 'B')")
+SUBTASK_SEARCH_DOC = "to_tsvector('english', title)"
+NOTE_SEARCH_DOC = "to_tsvector('english', content)"
+
+# ts_headline markers, swapped for <mark> after the snippet is HTML-escaped
+HIGHLIGHT_START, HIGHLIGHT_STOP = '\ue000', '\ue001'
+HEADLINE_OPTIONS = f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, MaxFragments=2, MaxWords=20, MinWords=5'
+
+SEARCH_PAGE_SIZE = 20
+
+def search_query(query, after=None, limit=SEARCH_PAGE_SIZE):
+    """SQL for one page of ranked full-text search over todos, subtasks and notes"""
+    params = [query]
+    keyset = ''
+    if after:
+        rank, kind, source_id = decode_cursor(after, 3)
+        keyset = 'WHERE rank < %s::real OR (rank = %s::real AND (kind, source_id) > (%s, %s))'
+        params += [rank, rank, kind, source_id]
+    params += [limit + 1, HEADLINE_OPTIONS]
+    
+    return f'''
+        WITH q AS (
+            SELECT websearch_to_tsquery('english', %s) AS query
+        ), hits AS (
+            SELECT 'note' AS kind, n.id AS source_id, n.todo_id, ts_rank({NOTE_SEARCH_DOC}, q.query) AS rank
+            FROM {ALL_NOTES} n, q
+            WHERE {NOTE_SEARCH_DOC} @@ q.query
+            UNION ALL
+            SELECT 'subtask', s.id, s.todo_id, ts_rank({SUBTASK_SEARCH_DOC}, q.query)
+            FROM {ALL_SUBTASKS} s, q
+            WHERE {SUBTASK_SEARCH_DOC} @@ q.query
+            UNION ALL
+            SELECT 'task', t.id, t.id, ts_rank({TODO_SEARCH_DOC}, q.query)
+            FROM {ALL_TODOS} t, q
+            WHERE {TODO_SEARCH_DOC} @@ q.query
+        ), page AS (
+            SELECT * FROM hits
+            {keyset}
+            ORDER BY rank DESC, kind, source_id
+            LIMIT %s
+        )
+        SELECT page.kind, page.source_id, page.todo_id, page.rank, t.task, t.completed,
+               t.archived_at IS NOT NULL AS archived,
+               ts_headline('english',
+                           CASE page.kind
+                               WHEN 'task' THEN concat_ws(' — ', t.task, t.description)
+                               WHEN 'subtask' THEN s.title
+                               ELSE n.content
+                           END,
+                           q.query, %s) AS snippet
+        FROM page
+        CROSS JOIN q
+        JOIN {ALL_TODOS} t ON t.id = page.todo_id
+        LEFT JOIN {ALL_SUBTASKS} s ON page.kind = 'subtask' AND s.id = page.source_id
+        LEFT JOIN {ALL_NOTES} n ON page.kind = 'note' AND n.id = page.source_id
+        ORDER BY page.rank DESC, page.kind, page.source_id
+    ''', params
+
+def search_result(rows, limit=SEARCH_PAGE_SIZE):
+    """Highlighted hits and the (rank, kind, id) cursor for the next page"""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([last['rank'], last['kind'], last['source_id']])
+    
+    results = []
+    for row in rows:
+        result = dict(row)
+        result['snippet'] = str(escape(row['snippet'] or '')).replace(
+            HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_STOP, '</mark>')
+        results.append(result)
+    return results, next_cursor
+
+def search_todos(cur, query, after=None, limit=SEARCH_PAGE_SIZE):
+    """Ranked full-text search over todos, subtasks and notes.
+
+    Returns one hit per matching row with a highlighted HTML snippet, and
+    a keyset cursor over (rank, kind, id) for the next page.
+    """
+    cur.execute(*search_query(query, after, limit))
+    return search_result(cur.fetchall(), limit)
+
+@app.route('/api/search')
+@login_required
+def api_search():
+    """API endpoint for ranked full-text search"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', SEARCH_PAGE_SIZE)), 1), 100)
+        with get_db_connection() as conn:
+            results, next_cursor = search_todos(conn.cursor(), query, after=request.args.get('after'), limit=limit)
+        return jsonify({'results': results, 'next_cursor': next_cursor})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Columns written by the exports and accepted by the importer
+EXPORT_FIELDS = ['id', 'task', 'description', 'completed', 'priority', 'due_date', 'category', 'created_at', 'updated_at']
+EXPORT_BATCH_SIZE = 2000
+IMPORT_CHUNK_SIZE = 1000
+PRIORITY_NAMES = {'low': 1, 'medium': 2, 'med': 2, 'high': 3}
+
+def iter_export_rows():
+    """Yield every todo as a dict, streamed through a server-side cursor"""
+    with get_db_connection() as conn:
+        cur = conn.cursor(name='todo_export')
+        cur.itersize = EXPORT_BATCH_SIZE
+        cur.execute(f'''
+            SELECT t.id, t.task, t.description, t.completed, t.priority, t.due_date,
+                   c.name AS category, t.created_at, t.updated_at
+            FROM {ALL_TODOS} t
+            LEFT JOIN categories c ON t.category_id = c.id
+            ORDER BY t.id
+        ''')
+        for row in cur:
+            yield row
+        cur.close()
+
+def export_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def generate_csv_export():
+    """Stream the todo export as CSV, a batch of rows per chunk"""
+    import csv
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for i, row in enumerate(iter_export_rows(), 1):
+        writer.writerow([export_value(row[field]) for field in EXPORT_FIELDS])
+        if i % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def generate_ndjson_export():
+    """Stream the todo export as newline-delimited JSON"""
+    lines = []
+    for row in iter_export_rows():
+        lines.append(json.dumps({field: export_value(row[field]) for field in EXPORT_FIELDS}))
+        if len(lines) >= EXPORT_BATCH_SIZE:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+def parse_import_rows(stream, fmt):
+    """Yield (line number, dict) pairs from a CSV or NDJSON text stream"""
+    if fmt == 'csv':
+        import csv
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_no, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                row = e
+            yield line_no, row
+
+def parse_import_row(row, category_ids):
+    """Validate one imported row into insert values, raising ValueError if invalid"""
+    if isinstance(row, Exception):
+        raise ValueError(f'Invalid JSON: {row}')
+    if not isinstance(row, dict):
+        raise ValueError('Expected an object')
+    
+    task = str(row.get('task') or '').strip()
+    if not task:
+        raise ValueError('task is required')
+    
+    priority = row.get('priority')
+    if priority in (None, ''):
+        priority = 1
+    elif str(priority).strip().lower() in PRIORITY_NAMES:
+        priority = PRIORITY_NAMES[str(priority).strip().lower()]
+    else:
+        try:
+            priority = int(priority)
+        except (TypeError, ValueError):
+            raise ValueError(f'Invalid priority: {priority}')
+        if priority not in (1, 2, 3):
+            raise ValueError(f'Invalid priority: {priority}')
+    
+    due_date = row.get('due_date') or None
+    if due_date:
+        try:
+            due_date = datetime.strptime(str(due_date)[:10], '%Y-%m-%d').date()
+        except ValueError:
+            raise ValueError(f'Invalid due_date: {due_date}')
+    
+    category_id = None
+    category = str(row.get('category') or '').strip()
+    if category:
+        category_id = category_ids.get(category.lower())
+        if category_id is None:
+            raise ValueError(f'Unknown category: {category}')
+    
+    completed = row.get('completed')
+    if isinstance(completed, str):
+        completed = completed.strip().lower() in ('true', '1', 'yes', 't', 'y')
+    
+    return (task, str(row.get('description') or '').strip(), bool(completed), priority, due_date, category_id)
+
+def import_todos(cur, rows):
+    """Insert parsed rows in chunks with execute_values.
+
+    ``rows`` yields (line number, row) pairs. Invalid rows are skipped and
+    reported; returns (number imported, list of {line, error}). The caller
+    commits.
+    """
+    cur.execute('SELECT id, name FROM categories')
+    category_ids = {category['name'].lower(): category['id'] for category in cur.fetchall()}
+    now = datetime.now()
+    
+    imported = 0
+    errors = []
+    chunk = []
+    
+    def flush():
+        psycopg2.extras.execute_values(cur, '''
+            INSERT INTO todos (task, description, completed, priority, due_date, category_id, created_at, updated_at)
+            VALUES %s
+        ''', chunk, template='(%s, %s, %s, %s, %s, %s, %s, %s)', page_size=IMPORT_CHUNK_SIZE)
+    
+    for line_no, row in rows:
+        try:
+            chunk.append(parse_import_row(row, category_ids) + (now, now))
+        except ValueError as e:
+            errors.append({'line': line_no, 'error': str(e)})
+            continue
+        if len(chunk) >= IMPORT_CHUNK_SIZE:
+            flush()
+            imported += len(chunk)
+            chunk = []
+    if chunk:
+        flush()
+        imported += len(chunk)
+    return imported, errors
+
+def import_format(filename, requested=None):
+    """Pick 'csv' or 'ndjson' from an explicit format or the file name"""
+    fmt = (requested or '').lower()
+    if not fmt:
+        fmt = 'csv' if (filename or '').lower().endswith('.csv') else 'ndjson'
+    if fmt in ('json', 'jsonl'):
+        fmt = 'ndjson'
+    if fmt not in ('csv', 'ndjson'):
+        raise ValueError(f'Unsupported format: {fmt}')
+    return fmt
+
+def import_upload():
+    """Import todos from the request's uploaded file or raw body"""
+    upload = request.files.get('file')
+    fmt = import_format(upload.filename if upload else None, request.args.get('format') or request.form.get('format'))
+    stream = io.TextIOWrapper(upload.stream if upload else request.stream, encoding='utf-8-sig', newline='')
+    with get_db_connection() as conn:
+        imported, errors = import_todos(conn.cursor(), parse_import_rows(stream, fmt))
+        conn.commit()
+    return imported, errors
+
+@app.route('/export/todos.<fmt>')
+@login_required
+def export_todos(fmt):
+    """Stream every todo as CSV or NDJSON"""
+    if fmt == 'csv':
+        body, mimetype = generate_csv_export(), 'text/csv'
+    elif fmt == 'ndjson':
+        body, mimetype = generate_ndjson_export(), 'application/x-ndjson'
+    else:
+        return jsonify({'error': 'Format must be csv or ndjson'}), 404
+    filename = f"todos-{datetime.now().strftime('%Y%m%d')}.{fmt}"
+    return Response(body, mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+@app.route('/api/import', methods=['POST'])
+@login_required
+def api_import():
+    """API endpoint for bulk importing todos from CSV or NDJSON"""
+    try:
+        imported, errors = import_upload()
+        return jsonify({'imported': imported, 'errors': errors})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/import_todos', methods=['POST'])
+@login_required
+def import_todos_form():
+    """Import todos from the dashboard upload form"""
+    try:
+        imported, errors = import_upload()
+        flash(f'Imported {imported} todo{"s" if imported != 1 else ""}! 📥', 'success')
+        if errors:
+            details = '; '.join(f"line {e['line']}: {e['error']}" for e in errors[:5])
+            flash(f'Skipped {len(errors)} invalid row{"s" if len(errors) != 1 else ""} ({details})', 'error')
+    except Exception as e:
+        flash(f'Error importing todos: {e}', 'error')
+    return redirect(url_for('dashboard'))
+
+BATCH_MAX_IDS = 1000
+
+def is_json_int(value):
+    """True for JSON integers; bool is an int subclass, so true/false are excluded"""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def parse_batch_operation(operation):
+    """Validate one batch operation into (op, ids, value), raising ValueError if invalid"""
+    if not isinstance(operation, dict):
+        raise ValueError('Each operation must be an object')
+    op = operation.get('op')
+    ids = operation.get('ids')
+    if not isinstance(ids, list) or not ids or not all(is_json_int(i) for i in ids):
+        raise ValueError(f'{op}: ids must be a non-empty list of integers')
+    if len(ids) > BATCH_MAX_IDS:
+        raise ValueError(f'{op}: at most {BATCH_MAX_IDS} ids per operation')
+    
+    value = operation.get('value')
+    if op in ('complete', 'reopen', 'delete'):
+        value = None
+    elif op == 'set_priority':
+        if not is_json_int(value) or value not in (1, 2, 3):
+            raise ValueError('set_priority: value must be 1, 2 or 3')
+    elif op == 'set_category':
+        if value is not None and not is_json_int(value):
+            raise ValueError('set_category: value must be a category id or null')
+    elif op == 'set_due_date':
+        if value is not None:
+            try:
+                value = datetime.strptime(str(value), '%Y-%m-%d').date()
+            except ValueError:
+                raise ValueError('set_due_date: value must be YYYY-MM-DD or null')
+    else:
+        raise ValueError(f'Unknown op: {op}')
+    return op, ids, value
+
+def apply_batch_operation(cur, op, ids, value, now):
+    """Apply one operation with a single statement.
+
+    Returns (affected ids, archived ids, activity note). Deletes reach the
+    archive too, like delete_todo; updates leave archived todos untouched
+    and report them as archived so callers can restore them first.
+    """
+    if op == 'delete':
+        cur.execute('''
+            WITH hot AS (
+                DELETE FROM todos WHERE id = ANY(%s) RETURNING id
+            ), cold AS (
+                DELETE FROM todos_archive WHERE id = ANY(%s) RETURNING id
+            )
+            SELECT id FROM hot UNION ALL SELECT id FROM cold
+        ''', (ids, ids))
+        return [row['id'] for row in cur.fetchall()], [], None
+    
+    if op in ('complete', 'reopen'):
+        completed = op == 'complete'
+        update = '''
+            UPDATE todos SET completed = %s, updated_at = %s
+            WHERE id = ANY(%s) AND completed != %s
+            RETURNING id
+        '''
+        params = [completed, now, ids, completed]
+        note = 'Task completed' if completed else 'Task reopened'
+    else:
+        column, note = {
+            'set_priority': ('priority', f"Priority set to {PRIORITY_LABELS.get(value)}"),
+            'set_category': ('category_id', 'Category changed'),
+            'set_due_date': ('due_date', f'Due date set to {value}' if value else 'Due date cleared'),
+        }[op]
+        update = f'''
+            UPDATE todos SET {column} = %s, updated_at = %s
+            WHERE id = ANY(%s) AND {column} IS DISTINCT FROM %s
+            RETURNING id
+        '''
+        params = [value, now, ids, value]
+    cur.execute(f'''
+        WITH updated AS ({update})
+        SELECT id, FALSE AS archived FROM updated
+        UNION ALL
+        SELECT id, TRUE AS archived FROM todos_archive WHERE id = ANY(%s)
+    ''', params + [ids])
+    rows = cur.fetchall()
+    return ([row['id'] for row in rows if not row['archived']],
+            [row['id'] for row in rows if row['archived']], note)
+
+@app.route('/api/todos/batch', methods=['POST'])
+@login_required
+def api_todos_batch():
+    """Apply a list of bulk operations to many todos in one transaction"""
+    payload = request.get_json(silent=True) or {}
+    operations = payload.get('operations')
+    try:
+        if not isinstance(operations, list) or not operations:
+            raise ValueError('operations must be a non-empty list')
+        operations = [parse_batch_operation(operation) for operation in operations]
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        now = datetime.now()
+        results = []
+        notes = []
+        deleted = set()
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+            for op, ids, value in operations:
+                affected, archived, note = apply_batch_operation(cur, op, ids, value, now)
+                results.append({'op': op, 'affected': affected, 'archived': archived})
+                if op == 'delete':
+                    deleted.update(affected)
+                elif note:
+                    notes.extend((todo_id, 'activity', note) for todo_id in affected)
+            
+            # Activity rows for every updated todo in one multi-row insert
+            notes = [note for note in notes if note[0] not in deleted]
+            if notes:
+                psycopg2.extras.execute_values(cur, '''
+                    INSERT INTO task_notes (todo_id, note_type, content) VALUES %s
+                ''', notes, page_size=len(notes))
+            conn.commit()
+        return jsonify({'results': results, 'notes': len(notes)})
+    except psycopg2.IntegrityError:
+        return jsonify({'error': 'Unknown category'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/add_todo', methods=['POST'])
 @login_required
@@ -472,6 +2678,8 @@ def add_todo():
     category_id = request.form.get('category_id') or None
     
     if not task:
+        if wants_json():
+            return jsonify({'error': 'Task cannot be empty'}), 400
         flash('Task cannot be empty!', 'error')
         return redirect(url_for('dashboard'))
     
@@ -481,11 +2689,17 @@ def add_todo():
             cur.execute('''
                 INSERT INTO todos (task, description, priority, due_date, category_id, updated_at)
                 VALUES (%s, %s, %s, %s, %s, %s)
+                RETURNING id
             ''', (task, description, priority, due_date, category_id, datetime.now()))
+            todo_id = cur.fetchone()['id']
             conn.commit()
+            if wants_json():
+                return jsonify(todo_payload(cur, todo_id)), 201
         
         flash('Todo added successfully! 🎉', 'success')
     except Exception as e:
+        if wants_json():
+            return jsonify({'error': str(e)}), 500
         flash(f'Error adding todo: {e}', 'error')
     
     return redirect(url_for('dashboard'))
@@ -497,22 +2711,28 @@ def toggle_todo(todo_id):
     try:
         with get_db_connection() as conn:
             cur = conn.cursor()
-            cur.execute('SELECT * FROM todos WHERE id = %s', (todo_id,))
+            cur.execute('''
+                UPDATE todos SET completed = NOT completed, updated_at = %s
+                WHERE id = %s
+                RETURNING completed
+            ''', (datetime.now(), todo_id))
             todo = cur.fetchone()
+            conn.commit()
             
+            if wants_json():
+                if not todo:
+                    return jsonify({'error': 'Todo not found'}), 404
+                return jsonify(todo_payload(cur, todo_id))
             if todo:
-                new_status = not todo['completed']
-                cur.execute('UPDATE todos SET completed = %s, updated_at = %s WHERE id = %s', 
-                           (new_status, datetime.now(), todo_id))
-                conn.commit()
-                
-                if new_status:
+                if todo['completed']:
                     flash('Todo completed! Great job! 🎯', 'success')
                     return redirect(url_for('dashboard', tab='completed'))
                 else:
                     flash('Todo reopened! Back to work! 💪', 'info')
                     return redirect(url_for('dashboard', tab='active'))
     except Exception as e:
+        if wants_json():
+            return jsonify({'error': str(e)}), 500
         flash(f'Error updating todo: {e}', 'error')
     
     return redirect(url_for('dashboard'))
@@ -525,14 +2745,50 @@ def delete_todo(todo_id):
         with get_db_connection() as conn:
             cur = conn.cursor()
             cur.execute('DELETE FROM todos WHERE id = %s', (todo_id,))
+            cur.execute('DELETE FROM todos_archive WHERE id = %s', (todo_id,))
             conn.commit()
+            if wants_json():
+                return jsonify(todo_payload(cur, todo_id))
         
         flash('Todo deleted! 🗑️', 'info')
     except Exception as e:
+        if wants_json():
+            return jsonify({'error': str(e)}), 500
         flash(f'Error deleting todo: {e}', 'error')
     
     return redirect(request.referrer or url_for('dashboard'))
 
+@app.route('/restore_todo/<int:todo_id>')
+@login_required
+def restore_todo(todo_id):
+    """Move an archived todo back to the hot tables"""
+    try:
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT id FROM todos_archive WHERE id = %s FOR UPDATE', (todo_id,))
+            if cur.fetchone():
+                move_todos(cur, [todo_id], restore=True)
+                # A fresh updated_at keeps it out of the next archive run
+                cur.execute('UPDATE todos SET updated_at = CURRENT_TIMESTAMP WHERE id = %s', (todo_id,))
+                cur.execute('''
+                    INSERT INTO task_notes (todo_id, note_type, content)
+                    VALUES (%s, %s, %s)
+                ''', (todo_id, 'activity', 'Restored from archive'))
+                conn.commit()
+                if wants_json():
+                    return jsonify(todo_payload(cur, todo_id))
+                flash('Todo restored from the archive! 📦', 'success')
+            else:
+                if wants_json():
+                    return jsonify({'error': 'Todo not found in the archive'}), 404
+                flash('Todo not found in the archive!', 'error')
+    except Exception as e:
+        if wants_json():
+            return jsonify({'error': str(e)}), 500
+        flash(f'Error restoring todo: {e}', 'error')
+    
+    return redirect(url_for('todo_detail', todo_id=todo_id))
+
 @app.route('/edit_todo/<int:todo_id>', methods=['GET', 'POST'])
 @login_required
 def edit_todo(todo_id):
@@ -549,6 +2805,8 @@ def edit_todo(todo_id):
                 category_id = request.form.get('category_id') or None
                 
                 if not task:
+                    if wants_json():
+                        return jsonify({'error': 'Task cannot be empty'}), 400
                     flash('Task cannot be empty!', 'error')
                     return redirect(url_for('edit_todo', todo_id=todo_id))
                 
@@ -565,14 +2823,15 @@ def edit_todo(todo_id):
                 ''', (todo_id, 'activity', f'Task details updated'))
                 
                 conn.commit()
+                if wants_json():
+                    return jsonify(todo_payload(cur, todo_id))
                 
                 flash('Todo updated successfully! ✏️', 'success')
                 return redirect(url_for('todo_detail', todo_id=todo_id))
             
             cur.execute('SELECT * FROM todos WHERE id = %s', (todo_id,))
             todo = cur.fetchone()
-            cur.execute('SELECT * FROM categories ORDER BY name')
-            categories = cur.fetchall()
+            categories = get_categories(cur)
             
             if not todo:
                 flash('Todo not found!', 'error')
@@ -581,6 +2840,8 @@ def edit_todo(todo_id):
             return render_template('edit_todo.html', todo=todo, categories=categories)
             
     except Exception as e:
+        if wants_json():
+            return jsonify({'error': str(e)}), 500
         flash(f'Error editing todo: {e}', 'error')
         return redirect(url_for('dashboard'))
 
@@ -591,8 +2852,7 @@ def categories():
     try:
         with get_db_connection() as conn:
             cur = conn.cursor()
-            cur.execute('SELECT * FROM categories ORDER BY name')
-            categories = cur.fetchall()
+            categories = get_categories(cur)
         return render_template('categories.html', categories=categories)
     except Exception as e:
         flash(f'Error loading categories: {e}', 'error')
@@ -613,7 +2873,9 @@ def add_category():
         with get_db_connection() as conn:
             cur = conn.cursor()
             cur.execute('INSERT INTO categories (name, color) VALUES (%s, %s)', (name, color))
+            notify_invalidation(cur, 'categories')
             conn.commit()
+        cache.invalidate('categories')
         flash('Category added successfully! 🏷️', 'success')
     except psycopg2.IntegrityError:
         flash('Category name already exists!', 'error')
@@ -630,7 +2892,9 @@ def delete_category(category_id):
         with get_db_connection() as conn:
             cur = conn.cursor()
             cur.execute('DELETE FROM categories WHERE id = %s', (category_id,))
+            notify_invalidation(cur, 'categories')
             conn.commit()
+        cache.invalidate('categories')
         flash('Category deleted! 🗑️', 'info')
     except Exception as e:
         flash(f'Error deleting category: {e}', 'error')
@@ -644,6 +2908,8 @@ def add_subtask(todo_id):
     title = request.form.get('title', '').strip()
     
     if not title:
+        if wants_json():
+            return jsonify({'error': 'Subtask title cannot be empty'}), 400
         flash('Subtask title cannot be empty!', 'error')
         return redirect(request.referrer or url_for('dashboard'))
     
@@ -651,26 +2917,36 @@ def add_subtask(todo_id):
         with get_db_connection() as conn:
             cur = conn.cursor()
             
-            # Get the next order index
-            cur.execute('SELECT MAX(order_index) as max_order FROM subtasks WHERE todo_id = %s', (todo_id,))
-            max_order = cur.fetchone()
-            next_order = (max_order['max_order'] or 0) + 1
-            
-            cur.execute('''
-                INSERT INTO subtasks (todo_id, title, order_index)
-                VALUES (%s, %s, %s)
-            ''', (todo_id, title, next_order))
-            
-            # Add activity log
+            # Bumping the parent's counter row-locks the todo, so concurrent
+            # adds get distinct order indexes; the activity log is chained on
             cur.execute('''
+                WITH parent AS (
+                    UPDATE todos SET subtask_seq = subtask_seq + 1
+                    WHERE id = %s
+                    RETURNING id, subtask_seq
+                ), added AS (
+                    INSERT INTO subtasks (todo_id, title, order_index)
+                    SELECT id, %s, subtask_seq FROM parent
+                    RETURNING todo_id, title
+                )
                 INSERT INTO task_notes (todo_id, note_type, content)
-                VALUES (%s, %s, %s)
-            ''', (todo_id, 'activity', f'Added subtask: {title}'))
-            
+                SELECT todo_id, 'activity', 'Added subtask: ' || title FROM added
+                RETURNING todo_id
+            ''', (todo_id, title))
+            added = cur.fetchone()
             conn.commit()
-        
-        flash('Subtask added! ✅', 'success')
+            # Nothing is inserted when the todo is missing or archived
+            if not added:
+                if wants_json():
+                    return jsonify({'error': 'Todo not found'}), 404
+                flash('Todo not found!', 'error')
+            elif wants_json():
+                return jsonify(todo_payload(cur, todo_id))
+            else:
+                flash('Subtask added! ✅', 'success')
     except Exception as e:
+        if wants_json():
+            return jsonify({'error': str(e)}), 500
         flash(f'Error adding subtask: {e}', 'error')
     
     return redirect(request.referrer or url_for('dashboard'))
@@ -682,22 +2958,30 @@ def toggle_subtask(subtask_id):
     try:
         with get_db_connection() as conn:
             cur = conn.cursor()
-            cur.execute('SELECT * FROM subtasks WHERE id = %s', (subtask_id,))
-            subtask = cur.fetchone()
-            
-            if subtask:
-                new_status = not subtask['completed']
-                cur.execute('UPDATE subtasks SET completed = %s WHERE id = %s', (new_status, subtask_id))
-                
-                # Add activity log
-                action = 'completed' if new_status else 'reopened'
-                cur.execute('''
-                    INSERT INTO task_notes (todo_id, note_type, content)
-                    VALUES (%s, %s, %s)
-                ''', (subtask['todo_id'], 'activity', f'Subtask "{subtask["title"]}" {action}'))
-                
-                conn.commit()
+            # Toggle and log the activity in one statement
+            cur.execute('''
+                WITH toggled AS (
+                    UPDATE subtasks SET completed = NOT completed
+                    WHERE id = %s
+                    RETURNING todo_id, title, completed
+                )
+                INSERT INTO task_notes (todo_id, note_type, content)
+                SELECT todo_id, 'activity',
+                       format('Subtask "%%s" %%s', title, CASE WHEN completed THEN 'completed' ELSE 'reopened' END)
+                FROM toggled
+                RETURNING todo_id
+            ''', (subtask_id,))
+            toggled = cur.fetchone()
+            conn.commit()
+            if not toggled:
+                if wants_json():
+                    return jsonify({'error': 'Subtask not found'}), 404
+                flash('Subtask not found!', 'error')
+            elif wants_json():
+                return jsonify(todo_payload(cur, toggled['todo_id']))
     except Exception as e:
+        if wants_json():
+            return jsonify({'error': str(e)}), 500
         flash(f'Error updating subtask: {e}', 'error')
     
     return redirect(request.referrer or url_for('dashboard'))
@@ -709,22 +2993,29 @@ def delete_subtask(subtask_id):
     try:
         with get_db_connection() as conn:
             cur = conn.cursor()
-            cur.execute('SELECT * FROM subtasks WHERE id = %s', (subtask_id,))
-            subtask = cur.fetchone()
-            
-            if subtask:
-                cur.execute('DELETE FROM subtasks WHERE id = %s', (subtask_id,))
-                
-                # Add activity log
-                cur.execute('''
-                    INSERT INTO task_notes (todo_id, note_type, content)
-                    VALUES (%s, %s, %s)
-                ''', (subtask['todo_id'], 'activity', f'Deleted subtask: {subtask["title"]}'))
-                
-                conn.commit()
-        
-        flash('Subtask deleted! 🗑️', 'info')
+            # Delete and log the activity in one statement
+            cur.execute('''
+                WITH deleted AS (
+                    DELETE FROM subtasks WHERE id = %s
+                    RETURNING todo_id, title
+                )
+                INSERT INTO task_notes (todo_id, note_type, content)
+                SELECT todo_id, 'activity', 'Deleted subtask: ' || title FROM deleted
+                RETURNING todo_id
+            ''', (subtask_id,))
+            deleted = cur.fetchone()
+            conn.commit()
+            if not deleted:
+                if wants_json():
+                    return jsonify({'error': 'Subtask not found'}), 404
+                flash('Subtask not found!', 'error')
+            elif wants_json():
+                return jsonify(todo_payload(cur, deleted['todo_id']))
+            else:
+                flash('Subtask deleted! 🗑️', 'info')
     except Exception as e:
+        if wants_json():
+            return jsonify({'error': str(e)}), 500
         flash(f'Error deleting subtask: {e}', 'error')
     
     return redirect(request.referrer or url_for('dashboard'))
@@ -736,98 +3027,212 @@ def add_note(todo_id):
     content = request.form.get('content', '').strip()
     
     if not content:
+        if wants_json():
+            return jsonify({'error': 'Note cannot be empty'}), 400
         flash('Note cannot be empty!', 'error')
         return redirect(request.referrer or url_for('edit_todo', todo_id=todo_id))
     
     try:
         with get_db_connection() as conn:
             cur = conn.cursor()
+            # Archived todos take no new notes, so only insert for a live todo
             cur.execute('''
                 INSERT INTO task_notes (todo_id, note_type, content)
-                VALUES (%s, %s, %s)
-            ''', (todo_id, 'note', content))
+                SELECT id, %s, %s FROM todos WHERE id = %s
+                RETURNING *
+            ''', ('note', content, todo_id))
+            note = cur.fetchone()
             conn.commit()
         
-        flash('Note added! 📝', 'success')
+        if not note:
+            if wants_json():
+                return jsonify({'error': 'Todo not found'}), 404
+            flash('Todo not found!', 'error')
+        elif wants_json():
+            return jsonify({'note': note, 'html': render_template('_note_item.html', note=note)}), 201
+        else:
+            flash('Note added! 📝', 'success')
     except Exception as e:
+        if wants_json():
+            return jsonify({'error': str(e)}), 500
         flash(f'Error adding note: {e}', 'error')
     
     return redirect(request.referrer or url_for('edit_todo', todo_id=todo_id))
 
+TODO_DETAIL_SQL = f'''
+    SELECT t.*, c.name as category_name, c.color as category_color
+    FROM {ALL_TODOS} t
+    LEFT JOIN categories c ON t.category_id = c.id
+    WHERE t.id = %s
+'''
+DETAIL_SUBTASKS_SQL = {
+    table: f'SELECT * FROM {table} WHERE todo_id = %s ORDER BY order_index, id'
+    for table in ('subtasks', 'subtasks_archive')
+}
+
 @app.route('/todo_detail/<int:todo_id>')
 @login_required
+@conditional('todos', 'subtasks', 'task_notes', 'categories',
+             'todos_archive', 'subtasks_archive', 'task_notes_archive')
 def todo_detail(todo_id):
     """Detailed view of a todo with notes and subtasks"""
     try:
         with get_db_connection() as conn:
             cur = conn.cursor()
             
-            # Get todo with category info
-            cur.execute('''
-                SELECT t.*, c.name as category_name, c.color as category_color
-                FROM todos t
-                LEFT JOIN categories c ON t.category_id = c.id
-                WHERE t.id = %s
-            ''', (todo_id,))
+            # Get todo with category info, from the archive if it has been moved there
+            cur.execute(TODO_DETAIL_SQL, (todo_id,))
             todo = cur.fetchone()
             
             if not todo:
                 flash('Todo not found!', 'error')
                 return redirect(url_for('dashboard'))
+            archived = todo['archived_at'] is not None
             
             # Get subtasks
-            cur.execute('''
-                SELECT * FROM subtasks WHERE todo_id = %s ORDER BY order_index, id
-            ''', (todo_id,))
+            cur.execute(DETAIL_SUBTASKS_SQL['subtasks_archive' if archived else 'subtasks'], (todo_id,))
             subtasks = cur.fetchall()
             
-            # Get notes and activity log
-            cur.execute('''
-                SELECT * FROM task_notes WHERE todo_id = %s ORDER BY created_at DESC
-            ''', (todo_id,))
-            notes = cur.fetchall()
+            # Latest notes and activity; older pages load from api_todo_notes
+            notes, next_notes_cursor = fetch_notes(cur, todo_id, archived=archived)
             
             # Get categories for editing
-            cur.execute('SELECT * FROM categories ORDER BY name')
-            categories = cur.fetchall()
+            categories = get_categories(cur)
             
             return render_template('todo_detail.html', 
                                  todo=todo, 
                                  subtasks=subtasks,
                                  notes=notes,
+                                 next_notes_cursor=next_notes_cursor,
                                  categories=categories)
                                  
     except Exception as e:
         flash(f'Error loading todo details: {e}', 'error')
         return redirect(url_for('dashboard'))
 
+@app.route('/api/todos/<int:todo_id>/notes')
+@login_required
+def api_todo_notes(todo_id):
+    """API endpoint returning an older page of a todo's notes"""
+    try:
+        limit = min(max(int(request.args.get('limit', NOTES_PAGE_SIZE)), 1), 200)
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+            notes, next_cursor = fetch_notes(cur, todo_id, before=request.args.get('before'), limit=limit,
+                                             archived=request.args.get('archived') == '1')
+        
+        html = render_template_string(
+            "{% for note in notes %}{% include '_note_item.html' %}{% endfor %}", notes=notes)
+        return jsonify({'notes': notes, 'html': html, 'next_cursor': next_cursor})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/todos/<int:todo_id>')
+@login_required
+def api_todo(todo_id):
+    """API endpoint returning one todo with its rendered card"""
+    try:
+        with get_db_connection() as conn:
+            payload = todo_payload(conn.cursor(), todo_id)
+        if payload['todo'] is None:
+            return jsonify({'error': 'Todo not found'}), 404
+        return jsonify(payload)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Server-sent events: each stream gets a queue fed from the shared LISTEN
+# connection, so open pages cost no database connections of their own
+EVENTS_CHANNEL = 'todo_events'
+SSE_KEEPALIVE = float(os.environ.get('SSE_KEEPALIVE', 15))
+SSE_QUEUE_SIZE = 1000
+
+@app.route('/api/events')
+@login_required
+def api_events():
+    """Stream todo change notifications as server-sent events"""
+    events = queue.Queue(maxsize=SSE_QUEUE_SIZE)
+    
+    def push(payload):
+        # A payload of None means notifications may have been missed
+        try:
+            events.put_nowait(payload)
+        except queue.Full:
+            with events.mutex:
+                events.queue.clear()
+            events.put_nowait(None)
+    
+    def stream():
+        listener.subscribe(EVENTS_CHANNEL, push)
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    payload = events.get(timeout=SSE_KEEPALIVE)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if payload is None:
+                    yield 'event: resync\ndata: {}\n\n'
+                else:
+                    yield f'data: {payload}\n\n'
+        finally:
+            listener.unsubscribe(EVENTS_CHANNEL, push)
+    
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Open counts come from the summary (one row per category, priority and
+# completion); overdue counts from an index-only scan of open todos
+CATEGORY_STATS_SQL = f'''
+    SELECT c.name, c.color, s.count, COALESCE(o.overdue, 0)::bigint as overdue
+    FROM (
+        SELECT category_key, SUM(todo_count)::bigint as count
+        FROM todo_stats_summary
+        WHERE NOT completed
+        GROUP BY category_key
+        HAVING SUM(todo_count) > 0
+    ) s
+    JOIN categories c ON c.id = s.category_key
+    LEFT JOIN (
+        SELECT category_id, COUNT(*) as overdue FROM ({OVERDUE_TODOS}) t GROUP BY category_id
+    ) o ON o.category_id = c.id
+    ORDER BY s.count DESC
+'''
+PRIORITY_STATS_SQL = f'''
+    SELECT NULLIF(s.priority_key, 0) as priority, s.count, COALESCE(o.overdue, 0)::bigint as overdue
+    FROM (
+        SELECT priority_key, SUM(todo_count)::bigint as count
+        FROM todo_stats_summary
+        WHERE NOT completed
+        GROUP BY priority_key
+        HAVING SUM(todo_count) > 0
+    ) s
+    LEFT JOIN (
+        SELECT COALESCE(priority, 0) as priority_key, COUNT(*) as overdue
+        FROM ({OVERDUE_TODOS}) t GROUP BY 1
+    ) o USING (priority_key)
+    ORDER BY s.priority_key DESC
+'''
+
 @app.route('/api/todo_stats')
 @login_required
+@conditional('todos', 'categories', max_age=API_CACHE_MAX_AGE)
 def todo_stats():
     """API endpoint for todo statistics"""
     try:
         with get_db_connection() as conn:
             cur = conn.cursor()
             
-            # Get todos by category
-            cur.execute('''
-                SELECT c.name, c.color, COUNT(t.id) as count
-                FROM categories c
-                LEFT JOIN todos t ON c.id = t.category_id AND t.completed = FALSE
-                GROUP BY c.id, c.name, c.color
-                HAVING COUNT(t.id) > 0
-                ORDER BY count DESC
-            ''')
+            today = datetime.now().date()
+            
+            # Open todos by category, from the stats summary
+            cur.execute(CATEGORY_STATS_SQL, (today,))
             category_stats = cur.fetchall()
             
-            # Get todos by priority
-            cur.execute('''
-                SELECT priority, COUNT(*) as count
-                FROM todos
-                WHERE completed = FALSE
-                GROUP BY priority
-                ORDER BY priority DESC
-            ''')
+            # Open todos by priority
+            cur.execute(PRIORITY_STATS_SQL, (today,))
             priority_stats = cur.fetchall()
             
             return jsonify({
@@ -838,6 +3243,15 @@ def todo_stats():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/db_pool')
+@login_required
+def db_pool_stats():
+    """API endpoint for connection pool counters"""
+    try:
+        return jsonify(get_pool().stats())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/settings', methods=['GET', 'POST'])
 @login_required
 def settings():
@@ -864,22 +3278,14 @@ def settings():
 @app.route('/test_email')
 @login_required
 def test_email():
-    """Test email functionality with detailed feedback"""
-    print("=" * 50)
-    print("STARTING EMAIL TEST")
-    print("=" * 50)
-    
+    """Queue a test email"""
     if send_email_notification(
         "🔧 Test Email from Todo App", 
         "<h2>Email notifications are working!</h2><p>This is a test email from your Todo app on Vercel.</p>"
     ):
-        flash('Test email sent successfully! 📧', 'success')
+        flash('Test email queued! It should arrive shortly. 📧', 'success')
     else:
-        flash('Failed to send test email. Check the Vercel logs for detailed error info.', 'error')
-    
-    print("=" * 50)
-    print("EMAIL TEST COMPLETED")
-    print("=" * 50)
+        flash('Email is not configured. Enable notifications and set your email and password first.', 'error')
     
     return redirect(url_for('settings'))
 
@@ -899,19 +3305,196 @@ def debug_email():
     <a href="/settings">Back to Settings</a>
     """
 
-# Initialize database on startup
-try:
-    print("Initializing database...")
-    init_db()
-    print("Database initialized successfully!")
+@app.cli.command('send-emails')
+@click.option('--loop', is_flag=True, help='Keep running and send new mail as it is queued.')
+def send_emails_command(loop):
+    """Deliver queued emails from the outbox."""
+    worker = EmailWorker()
+    if loop:
+        listener.subscribe(EMAIL_CHANNEL, lambda payload: worker.wake())
+    worker.run(once=not loop)
+    print(f"Sent {worker.sent} email(s), {worker.failed} failure(s)")
+
+@app.cli.command('run-jobs')
+@click.option('--job', 'job_names', multiple=True, help='Run only this job (repeatable).')
+@click.option('--force', is_flag=True, help='Run even if the interval has not elapsed.')
+@click.option('--loop', is_flag=True, help='Keep running, checking for due jobs every SCHEDULER_TICK seconds.')
+def run_jobs_command(job_names, force, loop):
+    """Run scheduled jobs such as the due-task digest."""
+    for name in job_names:
+        if name not in JOBS:
+            raise click.BadParameter(f"Unknown job {name}; choose from {', '.join(JOBS)}")
+    while True:
+        for name in job_names or JOBS:
+            result = run_job(name, force=force)
+            print(f"{name}: {'skipped' if result is None else result}")
+        if not loop:
+            break
+        time.sleep(SCHEDULER_TICK)
+
+@app.cli.command('export-todos')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), default='ndjson')
+@click.argument('output', type=click.File('w'), default='-')
+def export_todos_command(fmt, output):
+    """Export every todo to OUTPUT (stdout by default)."""
+    for chunk in (generate_csv_export() if fmt == 'csv' else generate_ndjson_export()):
+        output.write(chunk)
+
+@app.cli.command('import-todos')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), default=None,
+              help='Defaults to csv for .csv files and ndjson otherwise.')
+@click.argument('source', type=click.Path(exists=True, dir_okay=False))
+def import_todos_command(fmt, source):
+    """Bulk import todos from a CSV or NDJSON file."""
+    started = time.perf_counter()
+    with open(source, encoding='utf-8-sig', newline='') as stream:
+        with get_db_connection() as conn:
+            imported, errors = import_todos(conn.cursor(), parse_import_rows(stream, import_format(source, fmt)))
+            conn.commit()
+    for error in errors:
+        print(f"line {error['line']}: {error['error']}")
+    print(f"Imported {imported} todo(s) in {time.perf_counter() - started:.1f}s, {len(errors)} error(s)")
+
+def plan_check_writes(client):
+    """Drive every write path against scratch rows, removed again at the end.
+
+    Returns (method, path, status) for each request made.
+    """
+    marker = f'check-plans {secrets.token_hex(4)}'
+    today = datetime.now().date()
+    results = []
+    
+    def call(method, path, **kwargs):
+        response = client.open(path, method=method, headers={'Accept': 'application/json'}, **kwargs)
+        results.append((method, path, response.status_code))
+        return response.get_json(silent=True) or {}
+    
+    todo_id = call('POST', '/add_todo', data={'task': marker, 'priority': '2', 'due_date': str(today)}).get('id')
+    if todo_id is None:
+        return results
+    call('GET', f'/toggle_todo/{todo_id}')
+    call('POST', f'/edit_todo/{todo_id}', data={
+        'task': marker, 'description': marker, 'priority': '3', 'due_date': str(today)})
+    todo = call('POST', f'/add_subtask/{todo_id}', data={'title': marker}).get('todo') or {}
+    for subtask in todo.get('subtasks', []):
+        call('GET', f'/toggle_subtask/{subtask["id"]}')
+        call('GET', f'/delete_subtask/{subtask["id"]}')
+    call('POST', f'/add_note/{todo_id}', data={'content': marker})
+    call('GET', f'/api/todos/{todo_id}/notes')
+    call('POST', '/api/todos/batch', json={'operations': [
+        {'op': 'set_priority', 'ids': [todo_id], 'value': 1},
+        {'op': 'set_category', 'ids': [todo_id], 'value': None},
+        {'op': 'set_due_date', 'ids': [todo_id], 'value': str(today)},
+        {'op': 'reopen', 'ids': [todo_id]},
+        {'op': 'complete', 'ids': [todo_id]},
+    ]})
+    
+    # Archive and restore the scratch todo to cover both moves
+    with get_db_connection() as conn:
+        move_todos(conn.cursor(), [todo_id])
+        conn.commit()
+    call('GET', f'/restore_todo/{todo_id}')
+    
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT COALESCE(MAX(id), 0) AS id FROM todos')
+        before = cur.fetchone()['id']
+    rows = '\n'.join(json.dumps({'task': marker, 'priority': 'low'}) for _ in range(2))
+    call('POST', '/api/import?format=ndjson', data=rows, content_type='application/x-ndjson')
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT id FROM todos WHERE id > %s AND task = %s', (before, marker))
+        imported = [row['id'] for row in cur.fetchall()]
+    call('POST', '/api/todos/batch', json={'operations': [{'op': 'delete', 'ids': [todo_id] + imported}]})
+    
+    call('POST', '/add_category', data={'name': marker})
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT id FROM categories WHERE name = %s', (marker,))
+        category = cur.fetchone()
+    if category:
+        call('GET', f"/delete_category/{category['id']}")
+    return results
+
+@app.cli.command('check-plans')
+@click.option('--rows', type=int, default=None, help='Report sequential scans over tables larger than this.')
+@click.option('--with-writes', is_flag=True,
+              help='Also drive every write route against scratch rows (commits to the database).')
+@click.option('--with-jobs', is_flag=True,
+              help='Also run the scheduled jobs other than send_emails (they really run).')
+def check_plans_command(rows, with_writes, with_jobs):
+    """EXPLAIN the app's queries and fail on large sequential scans.
+
+    Only the read-only pages are checked by default. The write routes and
+    the jobs change the database, so they are opt-in; point those options at
+    a scratch copy, never at a live database.
+    """
+    global QUERY_PLAN_GUARD, QUERY_PLAN_GUARD_ROWS
+    QUERY_PLAN_GUARD = 'warn'
+    if rows is not None:
+        QUERY_PLAN_GUARD_ROWS = rows
+    del plan_violations[:]
     
-    # Check for due tasks on startup (only in production)
-    if not os.environ.get('FLASK_ENV') == 'development':
-        check_due_tasks()
-        print("Due tasks check completed")
-        
-except Exception as e:
-    print(f"Error during startup: {e}")
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT id FROM todos ORDER BY id DESC LIMIT 1')
+        latest = cur.fetchone()
+    
+    paths = [
+        '/', '/?tab=completed', '/?view=calendar', '/?tab=completed&view=calendar',
+        '/api/todos?tab=active', '/api/todos?tab=completed', '/api/todo_stats',
+        '/categories', '/settings', '/api/search?q=todo',
+    ]
+    month_start = datetime.now().date().replace(day=1)
+    month_end = (month_start + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+    for tab in ('active', 'completed'):
+        paths.append(f'/api/calendar?tab={tab}&start={month_start}&end={month_end}')
+    if latest:
+        paths += [f"/todo_detail/{latest['id']}", f"/edit_todo/{latest['id']}"]
+    
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['logged_in'] = True
+    results = [('GET', path, client.get(path).status_code) for path in paths]
+    if with_writes:
+        results += plan_check_writes(client)
+    for method, path, status in results:
+        print(f"{status} {method} {path}")
+    
+    if with_jobs:
+        # The due-today digest is queued as usual but not sent from here
+        os.environ['EMAIL_WORKER'] = 'off'
+        for name in JOBS:
+            if name != 'send_emails':
+                run_job(name, force=True)
+    
+    failed = [result for result in results if result[2] >= 500]
+    if failed:
+        print(f"{len(failed)} request(s) failed, so their queries were not all checked")
+        raise SystemExit(1)
+    if plan_violations:
+        print(f"{len(plan_violations)} sequential scan(s) over {QUERY_PLAN_GUARD_ROWS} rows found")
+        raise SystemExit(1)
+    print("No large sequential scans found")
+
+@app.route('/cron/run_jobs')
+def cron_run_jobs():
+    """Run due jobs; called by Vercel Cron with the CRON_SECRET bearer token"""
+    secret = os.environ.get('CRON_SECRET')
+    if not secret or request.headers.get('Authorization') != f'Bearer {secret}':
+        return jsonify({'error': 'Unauthorized'}), 401
+    try:
+        return jsonify(run_jobs())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint; requires METRICS_TOKEN as a bearer token when set"""
+    token = os.environ.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({'error': 'Unauthorized'}), 401
+    return Response(generate_latest(metrics_registry()), mimetype=CONTENT_TYPE_LATEST)
 
 # For local testing
 if __name__ == "__main__":
@@ -0,0 +1,315 @@
+"""Optional async server: the read-heavy routes on Starlette and asyncpg.
+
+Run with:
+    pip install -r requirements.txt -r requirements-async.txt
+    uvicorn asgi:app --workers 4
+
+The dashboard, todo detail page and the read-only /api endpoints are served
+natively from a pooled asyncpg data layer, with the dashboard's independent
+queries running concurrently. They share their SQL and row handling with
+api/index.py. Every other route, including the forms, mutations, SSE
+stream and cron endpoints, is passed through to the Flask app unchanged.
+"""
+import asyncio
+import os
+import re
+import sys
+from datetime import datetime
+from functools import lru_cache
+
+import asyncpg
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+from starlette.applications import Starlette
+from starlette.responses import HTMLResponse, RedirectResponse, Response
+from starlette.routing import Mount, Route
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api'))
+import index  # noqa: E402
+
+flask_app = WSGIMiddleware(index.app)
+pool = None
+
+DB_ERROR_PAGE = ('<h2>Database Error</h2><p>{}</p><p>Check your DATABASE_URL environment variable.</p>'
+                 '<a href="/login">Login</a>')
+
+
+@lru_cache(maxsize=None)
+def to_asyncpg(sql):
+    """Rewrite psycopg2 %s placeholders as asyncpg's numbered $n"""
+    count = 0
+
+    def placeholder(match):
+        nonlocal count
+        if match.group(1) == '%':
+            return '%'
+        count += 1
+        return f'${count}'
+    return re.sub(r'%([s%])', placeholder, sql)
+
+
+async def fetch(sql, params=()):
+    """Run a shared index.py query on the pool, returning rows as dicts"""
+    rows = await pool.fetch(to_asyncpg(sql), *params)
+    return [dict(row) for row in rows]
+
+
+async def fetchrow(sql, params=()):
+    """Run a shared index.py query on the pool, returning one row as a dict or None"""
+    row = await pool.fetchrow(to_asyncpg(sql), *params)
+    return dict(row) if row else None
+
+
+async def fetch_subtasks(todos):
+    """Async counterpart of index.attach_subtasks"""
+    if not todos:
+        return []
+    return index.subtasks_result(todos, await fetch(*index.subtasks_query(todos)))
+
+
+async def fetch_counts():
+    """Async counterpart of index.get_todo_counts"""
+    return index.todo_counts_result(await fetchrow(index.TODO_COUNTS_SQL, [datetime.now().date()]))
+
+
+def logged_in(request):
+    """Check the Flask session cookie; None means the Flask app should handle the request"""
+    cookie = request.cookies.get(index.app.config['SESSION_COOKIE_NAME'])
+    if not cookie:
+        return False
+    serializer = index.app.session_interface.get_signing_serializer(index.app)
+    try:
+        data = serializer.loads(cookie, max_age=int(index.app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return False
+    if '_flashes' in data:
+        # Flashed messages are popped from the session, which only Flask can write back
+        return None
+    return bool(data.get('logged_in'))
+
+
+def native(handler):
+    """Serve a route natively for logged-in users, deferring to Flask otherwise"""
+    async def endpoint(request):
+        state = logged_in(request)
+        if state is False:
+            return RedirectResponse('/login', status_code=302)
+        if state is None:
+            return flask_app
+        return await handler(request)
+    return endpoint
+
+
+def request_context(request):
+    """A Flask request context matching this request, for rendering templates"""
+    return index.app.test_request_context(request.url.path, query_string=request.url.query,
+                                          headers={'Cookie': request.headers.get('cookie', '')})
+
+
+def render(request, template, **context):
+    with request_context(request):
+        return index.render_template(template, **context)
+
+
+def render_each(request, template, name, items, **context):
+    """Render a partial once per item, the way the Flask routes' include loops do"""
+    source = f"{{% for {name} in items %}}{{% include '{template}' %}}{{% endfor %}}"
+    with request_context(request):
+        return index.render_template_string(source, items=items, **context)
+
+
+def json_response(data, status_code=200):
+    """Serialize like Flask's jsonify so both servers return identical bodies"""
+    return Response(index.app.json.dumps(data), status_code=status_code, media_type='application/json')
+
+
+def int_arg(request, name, default, upper):
+    return min(max(int(request.query_params.get(name, default)), 1), upper)
+
+
+@native
+async def dashboard(request):
+    tab = request.query_params.get('tab', 'active')
+    view = request.query_params.get('view', 'list')
+    try:
+        queries = [fetch(index.CATEGORIES_SQL), fetch_counts()]
+        if view != 'calendar':
+            queries.append(fetch(*index.todo_page_query(tab)))
+        categories, stats, *page = await asyncio.gather(*queries)
+    except Exception as e:
+        return HTMLResponse(DB_ERROR_PAGE.format(e), status_code=500)
+
+    today = datetime.now().date().strftime('%Y-%m-%d')
+    if view == 'calendar':
+        return HTMLResponse(render(request, 'calendar.html', categories=categories, today=today,
+                                   current_tab=tab, current_view=view, stats=stats))
+
+    rows, next_cursor = index.todo_page_result(tab, page[0])
+    try:
+        todos = await fetch_subtasks(rows)
+    except Exception as e:
+        return HTMLResponse(DB_ERROR_PAGE.format(e), status_code=500)
+    return HTMLResponse(render(request, 'dashboard.html', todos=todos, next_cursor=next_cursor,
+                               categories=categories, today=today, current_tab=tab,
+                               current_view=view, stats=stats))
+
+
+@native
+async def todo_detail(request):
+    todo_id = request.path_params['todo_id']
+    try:
+        todo = await fetchrow(index.TODO_DETAIL_SQL, [todo_id])
+        if not todo:
+            # Flask flashes the message and redirects
+            return flask_app
+        archived = todo['archived_at'] is not None
+        subtasks, notes, categories = await asyncio.gather(
+            fetch(index.DETAIL_SUBTASKS_SQL['subtasks_archive' if archived else 'subtasks'], [todo_id]),
+            fetch(*index.notes_query(todo_id, archived=archived)),
+            fetch(index.CATEGORIES_SQL))
+    except Exception:
+        return flask_app
+    notes, next_notes_cursor = index.notes_result(notes)
+    return HTMLResponse(render(request, 'todo_detail.html', todo=todo, subtasks=subtasks, notes=notes,
+                               next_notes_cursor=next_notes_cursor, categories=categories))
+
+
+@native
+async def api_todos(request):
+    tab = request.query_params.get('tab', 'active')
+    try:
+        if 'ids' in request.query_params:
+            ids = index.parse_todo_ids(request.query_params['ids'])
+            rows, counts = await asyncio.gather(fetch(index.TODOS_BY_IDS, [ids]), fetch_counts())
+            todos = await fetch_subtasks(rows)
+            today = datetime.now().date().strftime('%Y-%m-%d')
+            items = index.todo_items(ids, todos, lambda todo: render(request, '_todo_item.html',
+                                                                     todo=todo, today=today))
+            return json_response({'items': items, 'counts': counts})
+        limit = int_arg(request, 'limit', index.TODO_PAGE_SIZE, 200)
+        page, counts = await asyncio.gather(
+            fetch(*index.todo_page_query(tab, after=request.query_params.get('after'), limit=limit)),
+            fetch_counts())
+        rows, next_cursor = index.todo_page_result(tab, page, limit)
+        todos = await fetch_subtasks(rows)
+        html = render_each(request, '_todo_item.html', 'todo', todos,
+                           today=datetime.now().date().strftime('%Y-%m-%d'))
+        return json_response({'todos': todos, 'html': html, 'next_cursor': next_cursor, 'counts': counts})
+    except ValueError as e:
+        return json_response({'error': str(e)}, 400)
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+
+
+@native
+async def api_todo(request):
+    todo_id = request.path_params['todo_id']
+    try:
+        row, counts = await asyncio.gather(fetchrow(index.TODO_BY_ID, [todo_id]), fetch_counts())
+        if row is None:
+            return json_response({'error': 'Todo not found'}, 404)
+        todo = (await fetch_subtasks([row]))[0]
+        html = render(request, '_todo_item.html', todo=todo, today=datetime.now().date().strftime('%Y-%m-%d'))
+        return json_response({'id': todo_id, 'todo': todo, 'html': html, 'counts': counts})
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+
+
+@native
+async def api_todo_notes(request):
+    todo_id = request.path_params['todo_id']
+    try:
+        limit = int_arg(request, 'limit', index.NOTES_PAGE_SIZE, 200)
+        rows = await fetch(*index.notes_query(todo_id, before=request.query_params.get('before'), limit=limit,
+                                              archived=request.query_params.get('archived') == '1'))
+        notes, next_cursor = index.notes_result(rows, limit)
+        html = render_each(request, '_note_item.html', 'note', notes)
+        return json_response({'notes': notes, 'html': html, 'next_cursor': next_cursor})
+    except ValueError as e:
+        return json_response({'error': str(e)}, 400)
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+
+
+@native
+async def todo_stats(request):
+    today = datetime.now().date()
+    try:
+        category_stats, priority_stats = await asyncio.gather(
+            fetch(index.CATEGORY_STATS_SQL, [today]), fetch(index.PRIORITY_STATS_SQL, [today]))
+        return json_response({'categories': category_stats, 'priorities': priority_stats})
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+
+
+@native
+async def api_calendar(request):
+    tab = request.query_params.get('tab', 'active')
+    try:
+        start = datetime.strptime(request.query_params.get('start', ''), '%Y-%m-%d').date()
+        end = datetime.strptime(request.query_params.get('end', ''), '%Y-%m-%d').date()
+        per_day = int_arg(request, 'per_day', 3, 100)
+    except ValueError:
+        return json_response({'error': 'start and end must be YYYY-MM-DD dates'}, 400)
+    if end < start or (end - start).days >= index.CALENDAR_MAX_DAYS:
+        return json_response({'error': f'Date range must be between 1 and {index.CALENDAR_MAX_DAYS} days'}, 400)
+
+    try:
+        days = index.calendar_result(await fetch(*index.calendar_query(tab, start, end, per_day)))
+        return json_response({'start': start.isoformat(), 'end': end.isoformat(), 'days': days})
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+
+
+@native
+async def api_search(request):
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return json_response({'error': 'q is required'}, 400)
+    try:
+        limit = int_arg(request, 'limit', index.SEARCH_PAGE_SIZE, 100)
+        rows = await fetch(*index.search_query(query, after=request.query_params.get('after'), limit=limit))
+        results, next_cursor = index.search_result(rows, limit)
+        return json_response({'results': results, 'next_cursor': next_cursor})
+    except ValueError as e:
+        return json_response({'error': str(e)}, 400)
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+
+
+async def startup():
+    global pool
+    params = index.parse_database_url(index.get_database_url())
+    sslmode = params.pop('sslmode')
+    if index.SCHEMA_CHECK != 'off':
+        await asyncio.get_running_loop().run_in_executor(None, index.ensure_schema)
+    pool = await asyncpg.create_pool(
+        **params,
+        ssl=False if sslmode == 'disable' else sslmode,
+        min_size=int(os.environ.get('ASYNC_POOL_MIN', 2)),
+        max_size=int(os.environ.get('ASYNC_POOL_MAX', 20)),
+        max_inactive_connection_lifetime=float(os.environ.get('DB_POOL_MAX_IDLE', 300)),
+    )
+    print(f"asyncpg pool ready ({pool.get_min_size()}-{pool.get_max_size()} connections)")
+
+
+async def shutdown():
+    if pool is not None:
+        await pool.close()
+
+
+app = Starlette(
+    routes=[
+        Route('/', dashboard),
+        Route('/todo_detail/{todo_id:int}', todo_detail),
+        Route('/api/todos', api_todos),
+        Route('/api/todos/{todo_id:int}', api_todo),
+        Route('/api/todos/{todo_id:int}/notes', api_todo_notes),
+        Route('/api/todo_stats', todo_stats),
+        Route('/api/calendar', api_calendar),
+        Route('/api/search', api_search),
+        Mount('/', app=flask_app),
+    ],
+    on_startup=[startup],
+    on_shutdown=[shutdown],
+)
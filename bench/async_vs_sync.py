@@ -0,0 +1,175 @@
+"""Compare the sync (gunicorn + Flask) and async (uvicorn + asgi.py) servers.
+
+Usage:
+    DATABASE_URL=postgresql://localhost/todo?sslmode=disable \\
+        python bench/async_vs_sync.py --concurrency 32 --duration 20
+
+Both servers are started against the same DATABASE_URL with the same
+number of worker processes, then driven by the same closed-loop load:
+--concurrency keep-alive clients each request the --path list round-robin
+for --duration seconds after a short warm-up. Pass --sync-url/--async-url
+to measure servers that are already running instead.
+"""
+import argparse
+import http.client
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlencode, urlparse
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+DEFAULT_PATHS = ['/', '/api/todos?tab=active', '/api/todo_stats', '/api/search?q=report']
+
+
+def git_sha():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_server(kind, port, workers, threads):
+    env = dict(os.environ, FLASK_SECRET_KEY=os.environ.get('FLASK_SECRET_KEY', 'bench'),
+               SCHEDULER_THREAD='false')
+    if kind == 'sync':
+        command = ['gunicorn', '--chdir', 'api', '-w', str(workers), '-k', 'gthread',
+                   '--threads', str(threads), '-b', f'127.0.0.1:{port}', 'index:app']
+    else:
+        command = ['uvicorn', 'asgi:app', '--workers', str(workers), '--port', str(port),
+                   '--log-level', 'warning', '--no-access-log']
+    process = subprocess.Popen(command, cwd=ROOT, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/login')
+            connection.getresponse().read()
+            return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            if process.poll() is not None:
+                sys.exit(f'{kind} server exited with status {process.returncode}')
+            time.sleep(0.2)
+    process.terminate()
+    sys.exit(f'{kind} server did not start on port {port}')
+
+
+def login(url, password):
+    """Log in once and return the session cookie shared by every client"""
+    target = urlparse(url)
+    connection = http.client.HTTPConnection(target.hostname, target.port)
+    connection.request('POST', '/login', urlencode({'password': password}),
+                       {'Content-Type': 'application/x-www-form-urlencoded'})
+    response = connection.getresponse()
+    response.read()
+    cookie = response.getheader('Set-Cookie')
+    if response.status != 302 or not cookie:
+        sys.exit(f'Login to {url} failed with status {response.status}')
+    return cookie.split(';', 1)[0]
+
+
+def run_load(url, cookie, paths, concurrency, duration, warmup):
+    """Closed-loop load; returns latencies (ms) and error count recorded after the warm-up"""
+    target = urlparse(url)
+    started = time.monotonic()
+    record_from = started + warmup
+    stop_at = record_from + duration
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def client(offset):
+        connection = http.client.HTTPConnection(target.hostname, target.port, timeout=30)
+        mine, failed = [], 0
+        i = offset
+        while True:
+            now = time.monotonic()
+            if now >= stop_at:
+                break
+            path = paths[i % len(paths)]
+            i += 1
+            try:
+                connection.request('GET', path, headers={'Cookie': cookie})
+                response = connection.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection(target.hostname, target.port, timeout=30)
+                ok = False
+            if now >= record_from:
+                mine.append((time.monotonic() - now) * 1000)
+                failed += not ok
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    workers = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return latencies, errors[0]
+
+
+def summarize(latencies, errors, duration):
+    ordered = sorted(latencies)
+    if not ordered:
+        return {'requests': 0, 'errors': errors}
+    return {
+        'requests': len(ordered),
+        'errors': errors,
+        'requests_per_sec': round(len(ordered) / duration, 1),
+        'p50_ms': round(statistics.median(ordered), 2),
+        'p99_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))], 2),
+        'max_ms': round(ordered[-1], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--path', action='append', dest='paths', help='Path to request; repeatable.')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument('--workers', type=int, default=2, help='Server processes for both servers.')
+    parser.add_argument('--threads', type=int, default=8, help='gthread threads per sync worker.')
+    parser.add_argument('--sync-url')
+    parser.add_argument('--async-url')
+    args = parser.parse_args()
+    paths = args.paths or DEFAULT_PATHS
+    password = os.environ.get('SECRET_PASSWORD', 'opensesame')
+
+    results = {}
+    for kind, url, port in (('sync', args.sync_url, 8101), ('async', args.async_url, 8102)):
+        process = None
+        if not url:
+            process, url = start_server(kind, port, args.workers, args.threads)
+        try:
+            latencies, errors = run_load(url, login(url, password), paths,
+                                         args.concurrency, args.duration, args.warmup)
+        finally:
+            if process:
+                process.terminate()
+                process.wait()
+        results[kind] = summarize(latencies, errors, args.duration)
+
+    print(json.dumps({
+        'benchmark': 'async_vs_sync',
+        'git_sha': git_sha(),
+        'python': sys.version.split()[0],
+        'paths': paths,
+        'concurrency': args.concurrency,
+        'duration_s': args.duration,
+        'workers': args.workers,
+        'sync': results['sync'],
+        'async': results['async'],
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Benchmark cold starts of the api/index.py entry point.
+
+Usage:
+    python bench/cold_start.py --path /login --repeat 5
+    python bench/cold_start.py --path /dashboard --login --top 15
+
+Every sample runs in a fresh interpreter: it times `import index` and the
+first request through the Flask test client. A separate
+`python -X importtime` run lists the slowest modules pulled in by the
+import. Pages that touch the database need DATABASE_URL.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+API_DIR = os.path.join(ROOT, 'api')
+
+CHILD = '''
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import index
+imported = time.perf_counter()
+client = index.app.test_client()
+if sys.argv[3] == '1':
+    with client.session_transaction() as session:
+        session['logged_in'] = True
+response = client.get(sys.argv[2])
+response.get_data()
+finished = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_response_ms': (finished - imported) * 1000,
+    'status': response.status_code,
+}))
+'''
+
+
+def git_sha():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_sample(path, login):
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', CHILD, API_DIR, path, '1' if login else '0'],
+                            capture_output=True, text=True)
+    wall_ms = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        sys.exit(result.stderr)
+    sample = json.loads(result.stdout.strip().splitlines()[-1])
+    sample['process_ms'] = wall_ms
+    return sample
+
+
+def import_profile(top):
+    """Parse `-X importtime` output into the index total and the slowest modules"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import index'],
+                            cwd=API_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.exit(result.stderr)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append({
+            'module': name.strip(),
+            'self_ms': int(self_us) / 1000,
+            'cumulative_ms': int(cumulative_us) / 1000,
+        })
+    total = next((m['cumulative_ms'] for m in modules if m['module'] == 'index'), None)
+    slowest = sorted(modules, key=lambda m: m['self_ms'], reverse=True)[:top]
+    return total, slowest
+
+
+def summarize(values):
+    return {'min': round(min(values), 2), 'median': round(statistics.median(values), 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--path', default='/login')
+    parser.add_argument('--login', action='store_true', help='Send the request with a logged-in session.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='Number of slow modules to list.')
+    args = parser.parse_args()
+
+    samples = [run_sample(args.path, args.login) for _ in range(args.repeat)]
+    import_total, slowest = import_profile(args.top)
+
+    print(json.dumps({
+        'benchmark': 'cold_start',
+        'git_sha': git_sha(),
+        'python': sys.version.split()[0],
+        'path': args.path,
+        'repeat': args.repeat,
+        'status': samples[-1]['status'],
+        'import_ms': summarize([s['import_ms'] for s in samples]),
+        'first_response_ms': summarize([s['first_response_ms'] for s in samples]),
+        'process_ms': summarize([s['process_ms'] for s in samples]),
+        'importtime_index_ms': import_total,
+        'slowest_imports': [
+            {'module': m['module'], 'self_ms': m['self_ms'], 'cumulative_ms': m['cumulative_ms']}
+            for m in slowest
+        ],
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Compare two bench/suite.py result files.
+
+Usage:
+    python bench/compare.py                       # the two newest files in bench/results
+    python bench/compare.py OLD.json NEW.json --threshold 15
+
+Prints the median of every case in both runs and flags cases whose median
+grew by more than --threshold percent and at least --min-ms milliseconds.
+Cases the suite marked invalid (an unexpected response status) are not
+compared. Exits with status 1 when anything regressed or the new run has
+invalid cases.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def label(report, path):
+    sha = report.get('git_sha') or os.path.basename(path)
+    return f'{sha}{"+" if report.get("dirty") else ""}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('files', nargs='*', help='Baseline and candidate result files.')
+    parser.add_argument('--threshold', type=float, default=10, help='Allowed slowdown in percent.')
+    parser.add_argument('--min-ms', type=float, default=0.5, help='Ignore slowdowns smaller than this.')
+    args = parser.parse_args()
+
+    files = args.files
+    if not files:
+        files = sorted(glob.glob(os.path.join(RESULTS_DIR, '*.json')), key=os.path.getmtime)[-2:]
+    if len(files) != 2:
+        parser.error('need two result files')
+    old, new = load(files[0]), load(files[1])
+    print(f'{label(old, files[0])} -> {label(new, files[1])}')
+
+    regressions = invalid = 0
+    for size, dataset in new['datasets'].items():
+        baseline = old['datasets'].get(size)
+        if not baseline:
+            print(f'\n{size}: not in baseline')
+            continue
+        print(f'\n{size} ({dataset["todos"]:,} todos)')
+        print(f'  {"case":<30} {"old ms":>10} {"new ms":>10} {"change":>9}  queries')
+        for name, case in dataset['cases'].items():
+            before = baseline['cases'].get(name)
+            if 'invalid' in case:
+                invalid += 1
+                print(f'  {name:<30} INVALID ({case["invalid"]})')
+                continue
+            if before and 'invalid' in before:
+                print(f'  {name:<30} {"-":>10} {case["median_ms"]:>10.2f}  baseline invalid ({before["invalid"]})')
+                continue
+            if not before:
+                print(f'  {name:<30} {"-":>10} {case["median_ms"]:>10.2f} {"new":>9}')
+                continue
+            delta = case['median_ms'] - before['median_ms']
+            change = delta / before['median_ms'] * 100 if before['median_ms'] else 0
+            regressed = change > args.threshold and delta > args.min_ms
+            regressions += regressed
+            queries = ''
+            if 'queries' in case:
+                queries = f'{before.get("queries", "-")} -> {case["queries"]}'
+            print(f'  {name:<30} {before["median_ms"]:>10.2f} {case["median_ms"]:>10.2f} {change:>+8.1f}%  '
+                  f'{queries}{"  REGRESSION" if regressed else ""}')
+
+    if regressions:
+        print(f'\n{regressions} case(s) slower than {args.threshold:g}%')
+    if invalid:
+        print(f'\n{invalid} case(s) invalid in the new run')
+    if regressions or invalid:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
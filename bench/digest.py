@@ -0,0 +1,67 @@
+"""Benchmark rendering of the due-today digest email.
+
+Usage:
+    python bench/digest.py --tasks 10000 --repeat 5
+
+No database is needed; tasks are synthetic rows shaped like the ones
+check_due_tasks() claims.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from index import render_due_digest  # noqa: E402
+
+
+def make_tasks(count):
+    rng = random.Random(42)
+    categories = [('Work', '#3b82f6'), ('Personal', '#10b981'), (None, None)]
+    tasks = []
+    for i in range(count):
+        name, color = rng.choice(categories)
+        tasks.append({
+            'id': i,
+            'task': f'Task {i}',
+            'description': f'Description for task {i}' if rng.random() < 0.7 else '',
+            'priority': rng.choice([1, 2, 3]),
+            'category_name': name,
+            'category_color': color,
+        })
+    return tasks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tasks', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    tasks = make_tasks(args.tasks)
+    render_due_digest(tasks[:1])  # load and compile the template once
+
+    timings = []
+    size = 0
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        _, html = render_due_digest(tasks)
+        timings.append((time.perf_counter() - started) * 1000)
+        size = len(html)
+
+    print(json.dumps({
+        'benchmark': 'due_digest',
+        'tasks': args.tasks,
+        'repeat': args.repeat,
+        'min_ms': round(min(timings), 2),
+        'median_ms': round(statistics.median(timings), 2),
+        'html_bytes': size,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,426 @@
+"""Benchmark the app's key paths against seeded Postgres datasets.
+
+Usage:
+    python bench/suite.py                          # 1k and 100k in a throwaway cluster
+    python bench/suite.py --sizes 1k,100k,1m --repeat 30
+    python bench/suite.py --pg-data ~/.cache/todo-bench   # keep the cluster and datasets
+    BENCH_DATABASE_URL=postgresql://localhost/postgres?sslmode=disable python bench/suite.py
+
+Without BENCH_DATABASE_URL a private cluster is created with initdb and
+started with pg_ctl on a free port; it is removed afterwards unless
+--pg-data names a directory to keep. Each dataset lives in its own
+todo_bench_<size> database, migrated by migrate() and seeded with
+synthetic todos, subtasks and notes. Datasets are reused while the seed
+version matches; --reseed rebuilds them.
+
+Every dataset is timed in a fresh interpreter through Flask's test client:
+the dashboard on both tabs and both views, the calendar API, todo_detail,
+/api/todo_stats, check_due_tasks() and the JSON mutation routes. A case
+that answers with any other status than expected (200 for the reads) is
+marked invalid in the results and the run exits with status 1. Results go
+to bench/results/<git sha>.json; compare two runs with bench/compare.py.
+"""
+import argparse
+import contextlib
+import json
+import os
+import re
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from urllib.parse import urlparse
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+API_DIR = os.path.join(ROOT, 'api')
+RESULTS_DIR = os.path.join(ROOT, 'bench', 'results')
+
+SIZES = {'1k': 1000, '10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+# Bump when the generated data changes so stored datasets are rebuilt
+SEED_VERSION = 1
+SEED_CHUNK = 50_000
+
+CATEGORIES = [('Work', '#3b82f6'), ('Personal', '#10b981'), ('Errands', '#f59e0b'),
+              ('Health', '#ef4444'), ('Finance', '#8b5cf6'), ('Home', '#14b8a6'),
+              ('Learning', '#ec4899'), ('Travel', '#6366f1'), ('Family', '#84cc16'),
+              ('Side project', '#64748b')]
+
+# Fan-out per todo: 0-6 subtasks (mean 3), 0-8 notes (mean 4), and every
+# thousandth todo carries a long history of 200 notes. About 30% of todos
+# are completed, 20% have no due date and the rest fall within 90 days of
+# the seed date; roughly one in eleven has no category.
+SEED_TODOS = '''
+    INSERT INTO todos (id, task, description, completed, priority, due_date, category_id,
+                       created_at, updated_at, subtask_seq)
+    SELECT g,
+           (ARRAY['Write report', 'Review budget', 'Call client', 'Fix login bug', 'Plan trip',
+                  'Buy groceries', 'Renew passport', 'Prepare slides'])[1 + g %% 8] || ' #' || g,
+           CASE WHEN g %% 3 = 0 THEN NULL
+                ELSE 'Details for task ' || g || ': follow up with the team and update the tracker' END,
+           g %% 10 < 3,
+           1 + g %% 3,
+           CASE WHEN g %% 5 = 0 THEN NULL ELSE CURRENT_DATE + (g * 37 %% 181 - 90) END,
+           (%(categories)s::int[])[1 + g %% 11],
+           created,
+           created + make_interval(hours => g %% 72),
+           g %% 7
+    FROM generate_series(%(first)s, %(last)s) g,
+         LATERAL (SELECT now()::timestamp - make_interval(mins => %(total)s - g) AS created) c
+'''
+SEED_SUBTASKS = '''
+    INSERT INTO subtasks (todo_id, title, completed, order_index, created_at)
+    SELECT t.id, 'Step ' || s || ' of ' || t.task, t.completed OR s <= t.id %% 3, s,
+           t.created_at + make_interval(mins => s)
+    FROM todos t, generate_series(1, t.subtask_seq) s
+    WHERE t.id BETWEEN %(first)s AND %(last)s
+'''
+SEED_NOTES = '''
+    INSERT INTO task_notes (todo_id, note_type, content, created_at)
+    SELECT t.id,
+           CASE WHEN s %% 3 = 0 THEN 'note' ELSE 'activity' END,
+           CASE WHEN s %% 3 = 0 THEN 'Checked in on this, waiting for a reply (' || s || ')'
+                ELSE 'Updated todo: ' || t.task END,
+           t.created_at + make_interval(mins => s * 7)
+    FROM todos t,
+         generate_series(1, CASE WHEN t.id %% 1000 = 0 THEN 200 ELSE t.id * 7 %% 9 END) s
+    WHERE t.id BETWEEN %(first)s AND %(last)s
+'''
+
+SERVER_TIMING_DB = re.compile(r'db;dur=([\d.]+);desc="(\d+) queries"')
+
+
+def git_sha():
+    try:
+        sha = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                             capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                               capture_output=True, text=True, check=True).stdout.strip()
+        return sha, bool(dirty)
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+
+
+def pg_bin(name):
+    """Locate a Postgres server binary on PATH or under `pg_config --bindir`"""
+    found = shutil.which(name)
+    if found:
+        return found
+    try:
+        bindir = subprocess.run(['pg_config', '--bindir'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        sys.exit(f'{name} not found; install Postgres or set BENCH_DATABASE_URL')
+    return os.path.join(bindir, name)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def throwaway_cluster(data_dir=None):
+    """Run a private Postgres cluster, yielding the URL of its postgres database"""
+    keep = data_dir is not None
+    data_dir = os.path.abspath(os.path.expanduser(data_dir)) if keep else tempfile.mkdtemp(prefix='todo-bench-')
+    if not os.path.exists(os.path.join(data_dir, 'PG_VERSION')):
+        subprocess.run([pg_bin('initdb'), '-D', data_dir, '-U', 'bench', '-A', 'trust', '-E', 'UTF8'],
+                       check=True, stdout=subprocess.DEVNULL)
+    port = free_port()
+    options = f"-p {port} -k {data_dir} -c listen_addresses=127.0.0.1"
+    subprocess.run([pg_bin('pg_ctl'), '-D', data_dir, '-o', options, '-l', os.path.join(data_dir, 'server.log'),
+                    '-w', 'start'], check=True, stdout=subprocess.DEVNULL)
+    try:
+        yield f'postgresql://bench@127.0.0.1:{port}/postgres?sslmode=disable'
+    finally:
+        subprocess.run([pg_bin('pg_ctl'), '-D', data_dir, '-m', 'fast', '-w', 'stop'],
+                       check=False, stdout=subprocess.DEVNULL)
+        if not keep:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def connect(url):
+    import psycopg2
+    conn = psycopg2.connect(url)
+    conn.autocommit = True
+    return conn
+
+
+def dataset_url(admin_url, size, reseed):
+    """URL of the todo_bench_<size> database, recreated unless it holds a current seed"""
+    name = f'todo_bench_{size}'
+    url = urlparse(admin_url)._replace(path=f'/{name}').geturl()
+    marker = f'{SEED_VERSION}:{SIZES[size]}'
+
+    admin = connect(admin_url)
+    try:
+        cur = admin.cursor()
+        cur.execute('SELECT 1 FROM pg_database WHERE datname = %s', (name,))
+        if cur.fetchone() and not reseed:
+            conn = connect(url)
+            try:
+                cur2 = conn.cursor()
+                cur2.execute("SELECT to_regclass('settings') IS NOT NULL")
+                if cur2.fetchone()[0]:
+                    cur2.execute("SELECT value FROM settings WHERE key = 'bench_seed'")
+                    row = cur2.fetchone()
+                    if row and row[0] == marker:
+                        return url
+            finally:
+                conn.close()
+        cur.execute(f'DROP DATABASE IF EXISTS {name}')
+        cur.execute(f'CREATE DATABASE {name}')
+    finally:
+        admin.close()
+    return url
+
+
+def seed(url, total):
+    """Fill a freshly migrated database with the synthetic dataset"""
+    marker = f'{SEED_VERSION}:{total}'
+    conn = connect(url)
+    conn.autocommit = False
+    cur = conn.cursor()
+    cur.execute("SELECT value FROM settings WHERE key = 'bench_seed'")
+    row = cur.fetchone()
+    if row and row[0] == marker:
+        conn.close()
+        return None
+
+    started = time.perf_counter()
+    cur.execute('INSERT INTO categories (name, color) VALUES ' + ', '.join(['(%s, %s)'] * len(CATEGORIES))
+                + ' ON CONFLICT (name) DO NOTHING', [value for pair in CATEGORIES for value in pair])
+    cur.execute('SELECT id FROM categories ORDER BY id')
+    categories = [row[0] for row in cur.fetchall()][:10]
+    conn.commit()
+
+    for first in range(1, total + 1, SEED_CHUNK):
+        params = {'first': first, 'last': min(first + SEED_CHUNK - 1, total),
+                  'total': total, 'categories': categories}
+        for sql in (SEED_TODOS, SEED_SUBTASKS, SEED_NOTES):
+            cur.execute(sql, params)
+        conn.commit()
+        print(f'  seeded {params["last"]:,}/{total:,} todos', file=sys.stderr)
+
+    cur.execute("SELECT setval(pg_get_serial_sequence('todos', 'id'), %s)", (total,))
+    cur.execute("INSERT INTO settings (key, value) VALUES ('bench_seed', %s)", (marker,))
+    conn.commit()
+    conn.autocommit = True
+    cur.execute('VACUUM ANALYZE')
+    conn.close()
+    return round(time.perf_counter() - started, 2)
+
+
+def summarize(samples, expected=(200,)):
+    """Timing summary; a case with any unexpected status is marked invalid"""
+    timings = sorted(s['ms'] for s in samples)
+    summary = {
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        'min_ms': round(timings[0], 3),
+        'status': samples[-1]['status'],
+    }
+    unexpected = sorted({s['status'] for s in samples if s['status'] not in expected}, key=str)
+    if unexpected:
+        summary['invalid'] = f'status {", ".join(map(str, unexpected))}'
+    db = [s['db_ms'] for s in samples if s.get('db_ms') is not None]
+    if db:
+        summary['db_median_ms'] = round(statistics.median(db), 3)
+        summary['queries'] = samples[-1]['queries']
+    return summary
+
+
+def run_dataset(url, size, repeat, warmup):
+    """Time every case against one dataset; runs in its own interpreter"""
+    os.environ.update({
+        'DATABASE_URL': url,
+        'SCHEDULER_THREAD': 'false',
+        'CACHE_LISTEN': 'false',
+        'EMAIL_WORKER': 'off',
+        'QUERY_LOG_LEVEL': 'WARNING',
+    })
+    sys.path.insert(0, API_DIR)
+    import index
+
+    index.migrate()
+    seed_s = seed(url, SIZES[size])
+    index.save_email_config('bench@example.com', 'bench', True)
+
+    conn = connect(url)
+    cur = conn.cursor()
+    cur.execute('SELECT (SELECT count(*) FROM todos), (SELECT count(*) FROM subtasks), '
+                '(SELECT count(*) FROM task_notes)')
+    todos, subtasks, notes = cur.fetchone()
+    # One of the todos with a 200-note history, for todo_detail
+    cur.execute('SELECT max(id) FROM todos WHERE id % 1000 = 0')
+    detail_id = cur.fetchone()[0] or 1
+
+    client = index.app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = True
+    json_headers = {'Accept': 'application/json'}
+
+    def request(method, path, **kwargs):
+        def call():
+            return getattr(client, method)(path, **kwargs)
+        return call
+
+    def timed(fn, setup=None):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        response = fn()
+        sample = {'ms': (time.perf_counter() - started) * 1000}
+        if hasattr(response, 'status_code'):
+            response.get_data()
+            sample['status'] = response.status_code
+            match = SERVER_TIMING_DB.search(response.headers.get('Server-Timing', ''))
+            if match:
+                sample['db_ms'] = float(match.group(1))
+                sample['queries'] = int(match.group(2))
+        else:
+            sample['status'] = 'ok'
+        return sample, response
+
+    def bench(fn, setup=None, expected=(200,)):
+        for _ in range(warmup):
+            timed(fn, setup)
+        return summarize([timed(fn, setup)[0] for _ in range(repeat)], expected)
+
+    def reset_due_tasks():
+        cur.execute("DELETE FROM email_outbox")
+        cur.execute('UPDATE todos SET last_notified = NULL WHERE due_date = CURRENT_DATE AND NOT completed')
+
+    today = date.today()
+    month_start = today.replace(day=1)
+    month_end = (month_start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    calendar_path = f'/api/calendar?start={month_start}&end={month_end}'
+
+    cases = {
+        'dashboard_active': bench(request('get', '/?tab=active')),
+        'dashboard_completed': bench(request('get', '/?tab=completed')),
+        'dashboard_calendar_active': bench(request('get', '/?tab=active&view=calendar')),
+        'dashboard_calendar_completed': bench(request('get', '/?tab=completed&view=calendar')),
+        'api_calendar_active': bench(request('get', calendar_path + '&tab=active')),
+        'api_calendar_completed': bench(request('get', calendar_path + '&tab=completed')),
+        'todo_detail': bench(request('get', f'/todo_detail/{detail_id}')),
+        'todo_stats': bench(request('get', '/api/todo_stats')),
+        'check_due_tasks': bench(index.check_due_tasks, setup=reset_due_tasks, expected=('ok',)),
+    }
+    reset_due_tasks()
+
+    # Mutations run as a chain on a new todo, which the last step deletes
+    steps = {}
+    for iteration in range(warmup + repeat):
+        chain = []
+
+        def step(name, method, path, **kwargs):
+            sample, response = timed(request(method, path, headers=json_headers, **kwargs))
+            if sample['status'] >= 400:
+                sys.exit(f'{name} failed with {sample["status"]}: {response.get_data(as_text=True)}')
+            chain.append((name, sample))
+            return response.get_json()
+
+        added = step('add_todo', 'post', '/add_todo', data={
+            'task': f'Benchmark todo {iteration}', 'description': 'Created by bench/suite.py',
+            'priority': '2', 'due_date': str(today)})
+        todo_id = added['id']
+        step('toggle_todo', 'get', f'/toggle_todo/{todo_id}')
+        step('toggle_todo', 'get', f'/toggle_todo/{todo_id}')
+        step('edit_todo', 'post', f'/edit_todo/{todo_id}', data={
+            'task': f'Benchmark todo {iteration} (edited)', 'description': 'Edited by bench/suite.py',
+            'priority': '3', 'due_date': str(today + timedelta(days=1))})
+        payload = step('add_subtask', 'post', f'/add_subtask/{todo_id}', data={'title': 'Benchmark step'})
+        subtask_id = payload['todo']['subtasks'][-1]['id']
+        step('toggle_subtask', 'get', f'/toggle_subtask/{subtask_id}')
+        step('delete_subtask', 'get', f'/delete_subtask/{subtask_id}')
+        step('add_note', 'post', f'/add_note/{todo_id}', data={'content': 'Benchmark note'})
+        step('delete_todo', 'get', f'/delete_todo/{todo_id}')
+        if iteration >= warmup:
+            for name, sample in chain:
+                steps.setdefault(name, []).append(sample)
+    for name, samples in steps.items():
+        cases[name] = summarize(samples, expected=(200, 201))
+
+    cur.execute('SHOW server_version')
+    server_version = cur.fetchone()[0]
+    conn.close()
+    return {
+        'todos': todos,
+        'subtasks': subtasks,
+        'notes': notes,
+        'seed_s': seed_s,
+        'server_version': server_version,
+        'cases': cases,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1k,100k', help=f'Comma-separated, from {", ".join(SIZES)}.')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--reseed', action='store_true', help='Rebuild the datasets even if current.')
+    parser.add_argument('--pg-data', help='Keep the throwaway cluster in this directory between runs.')
+    parser.add_argument('--output', help='Result file (default bench/results/<git sha>.json).')
+    parser.add_argument('--dataset', help=argparse.SUPPRESS)
+    parser.add_argument('--database-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.dataset:
+        print(json.dumps(run_dataset(args.database_url, args.dataset, args.repeat, args.warmup), default=str))
+        return
+
+    sizes = [size.strip().lower() for size in args.sizes.split(',') if size.strip()]
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        parser.error(f'unknown sizes: {", ".join(unknown)}')
+
+    admin_url = os.environ.get('BENCH_DATABASE_URL')
+    cluster = contextlib.nullcontext(admin_url) if admin_url else throwaway_cluster(args.pg_data)
+    datasets = {}
+    invalid = 0
+    with cluster as admin_url:
+        for size in sizes:
+            print(f'{size}: preparing dataset', file=sys.stderr)
+            url = dataset_url(admin_url, size, args.reseed)
+            result = subprocess.run([sys.executable, __file__, '--dataset', size, '--database-url', url,
+                                     '--repeat', str(args.repeat), '--warmup', str(args.warmup)],
+                                    stdout=subprocess.PIPE, text=True)
+            if result.returncode != 0:
+                sys.exit(f'{size}: benchmark failed')
+            datasets[size] = json.loads(result.stdout.strip().splitlines()[-1])
+            for name, case in datasets[size]['cases'].items():
+                invalid += 'invalid' in case
+                print(f'{size:>5} {name:<30} {case["median_ms"]:>10.2f} ms'
+                      f'{"  INVALID (" + case["invalid"] + ")" if "invalid" in case else ""}', file=sys.stderr)
+
+    sha, dirty = git_sha()
+    report = {
+        'benchmark': 'suite',
+        'git_sha': sha,
+        'dirty': dirty,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'repeat': args.repeat,
+        'warmup': args.warmup,
+        'datasets': datasets,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f'{sha or "unknown"}{"-dirty" if dirty else ""}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+        f.write('\n')
+    print(output)
+    if invalid:
+        sys.exit(f'{invalid} case(s) returned an unexpected status')
+
+
+if __name__ == '__main__':
+    main()